@@ -0,0 +1,276 @@
+#!/usr/bin/python
+
+# Benchmark of NATNetwork: builds and tears down the network for every
+# combination of the swept parameters, recording how long it took and the
+# resources it used. Results are compared with those of a previous run to
+# catch regressions.
+
+from mininet.log import setLogLevel, info, error
+from mininet.clean import cleanup
+from mininet.net import Mininet
+from main import startNetwork, stopNetwork
+from plan import compilePlan
+from metrics import Metrics
+from cores import CORES
+from fakenet import FakeNet
+from collections import OrderedDict
+import itertools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import traceback
+
+# Results compared with the baseline, lower is better
+COMPARED = ['bringup', 'teardown', 'memory', 'maxrss', 'commands']
+
+# Results that must match for two results to be compared
+KEY = ['nrouters', 'nhosts', 'core', 'workers', 'useNetlink', 'backend']
+
+def meminfo(field):
+    # Value (kB) of a field of /proc/meminfo
+    with open('/proc/meminfo') as f:
+        for line in f:
+            name, value = line.split(':')
+            if name == field:
+                return int(value.split()[0])
+    return None
+
+def machine():
+    # Description of the host the benchmark runs on
+    return OrderedDict([('hostname', platform.node()), ('kernel', platform.release()),
+                        ('cpus', os.cpu_count()), ('memory', meminfo('MemTotal')),
+                        ('python', platform.python_version())])
+
+def sampleMemory(interval=0.05):
+    """Sample MemAvailable in a thread until the returned function is
+       called, which gives how far it dropped (kB) since the start"""
+    start = meminfo('MemAvailable')
+    lowest = [start]
+    done = threading.Event()
+    def sample():
+        while not done.wait(interval):
+            lowest[0] = min(lowest[0], meminfo('MemAvailable'))
+    thread = threading.Thread(target=sample)
+    thread.daemon = True
+    thread.start()
+    def stop():
+        done.set()
+        thread.join()
+        return max(0, start - min(lowest[0], meminfo('MemAvailable')))
+    return stop
+
+def namespaces(net):
+    # Number of distinct network namespaces of the nodes of net
+    spaces = set()
+    for node in net.hosts + net.switches:
+        if node.pid is None: # Simulated node
+            continue
+        try:
+            spaces.add(os.readlink('/proc/%d/ns/net' % node.pid))
+        except OSError:
+            pass
+    return len(spaces)
+
+def measure(nrouters, nhosts, core, workers=None, useNetlink=False, firewall='iptables',
+            netClass=Mininet):
+    """Build and tear down one network (simulated if netClass is FakeNet).
+       memory is the peak of the memory used by the whole host while the
+       network is up.
+       returns: dict of the results, with 'error' set if it could not be built"""
+    result = OrderedDict([('nrouters', nrouters), ('nhosts', nhosts), ('core', core),
+                          ('workers', workers), ('useNetlink', useNetlink),
+                          ('backend', 'simulated' if getattr(netClass, 'simulated', False)
+                           else 'mininet')])
+    plan = compilePlan(nrouters=nrouters, nhosts=nhosts, firewall=firewall, core=core)
+    if plan is None:
+        result['error'] = 'does not fit in the address space'
+        return result
+    result['routes'] = sum(len(routes) for routes in plan.routes.values())
+    result['rules'] = sum(len(rules) for rules in plan.rules().values())
+
+    metrics = Metrics()
+    memory = sampleMemory()
+    metrics.start()
+    try:
+        start = time.time()
+        net, rules = startNetwork(plan, workers, useNetlink, metrics, netClass)
+        result['bringup'] = time.time() - start
+        result['namespaces'] = namespaces(net)
+        result['veths'] = 2 * len(net.links)
+        start = time.time()
+        stopNetwork(net, plan, rules, metrics)
+        result['teardown'] = time.time() - start
+    except Exception as e:
+        error('*** Run failed:', e, '\n')
+        result['error'] = str(e) or e.__class__.__name__
+        if netClass is Mininet:
+            cleanup()
+    finally:
+        metrics.stop()
+        result['memory'] = memory()
+    result['commands'] = metrics.commands
+    result['phases'] = metrics.asDict()['phases']
+    return result
+
+def isolated(*args, **kwargs):
+    """measure() in a child process, so that the peak resident memory of
+       the benchmark (maxrss, kB) is the one of this run alone"""
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        status = 0
+        try:
+            data = json.dumps(measure(*args, **kwargs))
+        except BaseException:
+            data, status = json.dumps({'error': traceback.format_exc()}), 1
+        with os.fdopen(wfd, 'w') as f:
+            f.write(data)
+        sys.stdout.flush()
+        os._exit(status)
+    os.close(wfd)
+    with os.fdopen(rfd) as f:
+        data = f.read()
+    pid, status, usage = os.wait4(pid, 0)
+    result = OrderedDict(zip(['nrouters', 'nhosts', 'core'], args))
+    if data:
+        result.update(json.loads(data, object_pairs_hook=OrderedDict))
+    else:
+        result['error'] = 'benchmark process died with status %d' % status
+    result['maxrss'] = usage.ru_maxrss
+    return result
+
+def key(result):
+    return tuple(result.get(field) for field in KEY)
+
+def describe(result):
+    return '%s core with %d routers and %d hosts (%s, %s workers%s)' % (
+        result['core'], result['nrouters'], result['nhosts'], result.get('backend'),
+        result.get('workers') or 'no', ', netlink' if result.get('useNetlink') else '')
+
+def compare(results, baseline, threshold):
+    """Results that are worse than in baseline by more than threshold
+       (1.2: 20% worse).
+       returns: list of (result, metric, value, baseline value)"""
+    previous = dict((key(result), result) for result in baseline)
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            info('*** No baseline for %s\n' % describe(result))
+            continue
+        if 'error' in old:
+            continue
+        if 'error' in result:
+            regressions.append((result, 'error', result['error'], None))
+            continue
+        for metric in COMPARED:
+            value, oldValue = result.get(metric), old.get(metric)
+            if value is None or not oldValue or oldValue < 0:
+                continue
+            if float(value) / oldValue > threshold:
+                regressions.append((result, metric, value, oldValue))
+    return regressions
+
+def sweep(nrouters, nhosts, cores, repeat=1, maxSeconds=None, **params):
+    """Measure every combination of nrouters, nhosts and cores, keeping the
+       best of repeat runs. Bigger networks of a core are skipped once one
+       fails or takes longer than maxSeconds to bring up."""
+    results = []
+    limits = {} # core -> smallest failed (nrouters, nhosts)
+    for core, r, h in itertools.product(cores, sorted(nrouters), sorted(nhosts)):
+        limit = limits.get(core)
+        if limit is not None and r >= limit[0] and h >= limit[1]:
+            info('*** Skipping %s core with %d routers and %d hosts\n' % (core, r, h))
+            continue
+        info('*** Measuring %s core with %d routers and %d hosts\n' % (core, r, h))
+        runs = [isolated(r, h, core, **params) for i in range(repeat)]
+        good = [run for run in runs if 'error' not in run]
+        result = min(good, key=lambda run: run['bringup']) if good else runs[0]
+        results.append(result)
+        if 'error' in result or (maxSeconds is not None and result['bringup'] > maxSeconds):
+            limits[core] = (r, h)
+    return results
+
+def show(results):
+    info('*** %-10s %8s %6s %9s %9s %9s %9s %6s %6s %7s %6s\n' % (
+        'core', 'routers', 'hosts', 'bringup', 'teardown', 'memory', 'maxrss', 'ns',
+        'veths', 'routes', 'rules'))
+    for r in results:
+        if 'error' in r:
+            info('    %-10s %8d %6d  %s\n' % (r['core'], r['nrouters'], r['nhosts'], r['error']))
+        else:
+            info('    %-10s %8d %6d %8.2fs %8.2fs %6dMiB %6dMiB %6d %6d %7d %6d\n' % (
+                r['core'], r['nrouters'], r['nhosts'], r['bringup'], r['teardown'],
+                r['memory'] // 1024, r['maxrss'] // 1024, r['namespaces'], r['veths'],
+                r['routes'], r['rules']))
+
+def counts(value):
+    # Parse a list argument: '2,4,8'
+    return [int(n) for n in value.split(',')]
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Benchmark the bring-up and teardown of NATNetwork.')
+    parser.add_argument("-N","--nrouters",dest="nrouters", default=[2, 4, 8], type=counts,
+                        help="Comma separated numbers of routers to sweep. Default: 2,4,8")
+    parser.add_argument("-n","--nhosts",dest="nhosts", default=[1, 3], type=counts,
+                        help="Comma separated numbers of hosts per router to sweep. "
+                        "Default: 1,3")
+    parser.add_argument("--core",dest="cores", default=['mesh'],
+                        type=lambda value: value.split(','),
+                        help="Comma separated core topologies to sweep (%s). Default: mesh"
+                        % ', '.join(sorted(CORES)))
+    parser.add_argument("-w","--workers",dest="workers", default=None, type=int,
+                        help="Create up to WORKERS nodes and links at the same time")
+    parser.add_argument("--netlink",dest="useNetlink", action='store_true',
+                        help="Set addresses and routes over netlink")
+    parser.add_argument("--simulate",dest="netClass", action='store_const',
+                        const=FakeNet, default=Mininet,
+                        help="Build the networks in memory (see fakenet.FakeNet) to "
+                        "measure the build logic alone, without root")
+    parser.add_argument("-r","--repeat",dest="repeat", default=1, type=int,
+                        help="Runs of each combination, the fastest one is kept. Default: 1")
+    parser.add_argument("--max-seconds",dest="maxSeconds", default=None, type=float,
+                        help="Skip the bigger networks of a core once one takes longer "
+                        "than this to bring up")
+    parser.add_argument("-o","--output",dest="output", default='bench.json',
+                        help="File the results are written to. Default: bench.json")
+    parser.add_argument("-b","--baseline",dest="baseline", default=None,
+                        help="Results of a previous run on the same machine to compare "
+                        "with. Exits with status 1 if any result regressed, 2 if it was "
+                        "measured on another machine")
+    parser.add_argument("-t","--threshold",dest="threshold", default=1.2, type=float,
+                        help="Ratio to the baseline that counts as a regression. "
+                        "Default: 1.2")
+    args = parser.parse_args()
+    for core in args.cores:
+        if core not in CORES:
+            parser.error("unknown core %s (choose from %s)" % (core, ', '.join(sorted(CORES))))
+
+    setLogLevel('info')
+    results = sweep(args.nrouters, args.nhosts, args.cores, repeat=args.repeat,
+                    maxSeconds=args.maxSeconds, workers=args.workers,
+                    useNetlink=args.useNetlink, netClass=args.netClass)
+    show(results)
+    with open(args.output, 'w') as f:
+        json.dump(OrderedDict([('machine', machine()), ('time', time.time()),
+                               ('threshold', args.threshold), ('results', results)]),
+                  f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['machine'] != machine():
+            error('*** %s was measured on another machine (%s), not comparing\n' % (
+                args.baseline, ', '.join('%s %s' % item for item in baseline['machine'].items())))
+            sys.exit(2)
+        regressions = compare(results, baseline['results'], args.threshold)
+        for result, metric, value, old in regressions:
+            error('*** Regression of %s with %s: %s -> %s\n' % (
+                metric, describe(result), old, value))
+        if regressions:
+            sys.exit(1)
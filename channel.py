@@ -0,0 +1,83 @@
+from mininet.log import debug
+import time
+
+class Channel(object):
+    """Pipelined commands for the shell of one node.
+       Queued commands are written to the shell in a single write, one per
+       line, each followed by a printf of its exit status. The shell prints
+       its prompt (the chr(127) sentinel of Mininet) after every line, so
+       the outputs are split apart again by counting sentinels.
+       Commands must not read from their standard input, which would eat
+       the commands queued after them."""
+    def __init__(self, node):
+        self.node = node
+        self.cmds = []
+        self.buf = ''
+        self.results = None
+        self.sent = None # Time the commands were written
+        self.ends = []   # Time each command finished
+
+    def add(self, cmd):
+        # Queue cmd, returns the index of its result
+        self.cmds.append(cmd.strip())
+        return len(self.cmds) - 1
+
+    @staticmethod
+    def background(cmd):
+        return cmd.endswith('&') and not cmd.endswith('&&')
+
+    def send(self):
+        # Write every queued command to the shell, without waiting for them
+        node = self.node
+        assert node.shell and not node.waiting
+        lines = []
+        for cmd in self.cmds:
+            if self.background(cmd):
+                lines.append(cmd)
+            else:
+                lines.append('%s; printf "\\036%%d" $?' % cmd.rstrip(';'))
+        debug('*** %s : %s\n' % (node.name, self.cmds))
+        self.buf = ''
+        self.results = None
+        self.ends = []
+        self.sent = time.time()
+        node.write('\n'.join(lines) + '\n')
+        node.waiting = True
+
+    def poll(self):
+        """Read the output available without blocking.
+           Returns True once every command has finished."""
+        node = self.node
+        while node.waiting and (node.readbuf or node.pollOut.poll(0)):
+            data = node.read(1024)
+            self.buf += data
+            self.ends.extend([time.time()] * data.count(chr(127)))
+            if len(self.ends) >= len(self.cmds):
+                node.waiting = False
+                self.split()
+        return not node.waiting
+
+    def wait(self, timeoutms=None):
+        """Wait for every command to finish.
+           returns: [(output, status)] in the order of the commands, where
+                    status is None for commands sent to the background"""
+        while not self.poll():
+            if not self.node.waitReadable(timeoutms):
+                raise RuntimeError('No output from %s after %s ms' %
+                                   (self.node.name, timeoutms))
+        return self.results
+
+    def run(self, timeoutms=None):
+        self.send()
+        return self.wait(timeoutms)
+
+    def split(self):
+        self.results = []
+        outputs = self.buf.split(chr(127))
+        for cmd, output in zip(self.cmds, outputs):
+            status = None
+            if not self.background(cmd):
+                output, _, status = output.rpartition('\036')
+                status = int(status) if status.strip().isdigit() else None
+            self.results.append((output, status))
+        self.cmds = []
@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from math import sqrt
+
+class Core(object):
+    """Graph of the core that interconnects the routers.
+       Routers r1..rN own a local subnet and use ports 0 (NAT side) and 1
+       (local subnet), so their core links start at port 2. Transit routers
+       t1..tM only forward traffic between routers and start at port 0."""
+    def __init__(self, nrouters, ntransit=0):
+        self.routers = ['r%d' % i for i in range(1, nrouters + 1)]
+        self.transit = ['t%d' % i for i in range(1, ntransit + 1)]
+        self.nextPort = dict((r, 2) for r in self.routers)
+        self.nextPort.update((t, 0) for t in self.transit)
+        self.neighbors = OrderedDict((n, []) for n in self.nodes())
+        self.links = [] # (node1, port1, node2, port2)
+
+    def nodes(self):
+        return self.routers + self.transit
+
+    def addLink(self, node1, node2):
+        port1, port2 = self.nextPort[node1], self.nextPort[node2]
+        self.nextPort[node1] += 1
+        self.nextPort[node2] += 1
+        self.neighbors[node1].append(node2)
+        self.neighbors[node2].append(node1)
+        self.links.append((node1, port1, node2, port2))
+
+def meshCore(nrouters):
+    # Every router is linked to every other router
+    core = Core(nrouters)
+    for i, r1 in enumerate(core.routers):
+        for r2 in core.routers[i+1:]:
+            core.addLink(r1, r2)
+    return core
+
+def ringCore(nrouters):
+    # Every router is linked to the next one, and the last one to the first
+    core = Core(nrouters)
+    r = core.routers
+    for i in range(len(r) - 1):
+        core.addLink(r[i], r[i+1])
+    if len(r) > 2:
+        core.addLink(r[-1], r[0])
+    return core
+
+def starCore(nrouters):
+    # Every router is linked to a transit hub
+    core = Core(nrouters, ntransit=1)
+    for r in core.routers:
+        core.addLink(r, core.transit[0])
+    return core
+
+def hierarchyCore(nrouters, groupSize=None):
+    """Two levels: routers are split in groups of groupSize (default
+       ~sqrt(nrouters)), linked to the first router of their group, and the
+       first routers of all groups are linked in a mesh"""
+    core = Core(nrouters)
+    size = groupSize or max(2, int(round(sqrt(nrouters))))
+    leaders = core.routers[::size]
+    for i, leader in enumerate(leaders):
+        for r in core.routers[i*size+1:(i+1)*size]:
+            core.addLink(r, leader)
+    for i, l1 in enumerate(leaders):
+        for l2 in leaders[i+1:]:
+            core.addLink(l1, l2)
+    return core
+
+def fatTreeCore(nrouters, nspines=None):
+    """Two-tier fat tree (leaf-spine): every router is linked to each of
+       nspines (default ~sqrt(nrouters), at least 2) transit routers"""
+    core = Core(nrouters, ntransit=nspines or max(2, int(round(sqrt(nrouters)))))
+    for r in core.routers:
+        for t in core.transit:
+            core.addLink(r, t)
+    return core
+
+# Core topologies that can be selected from the command line
+CORES = {'mesh': meshCore, 'ring': ringCore, 'star': starCore,
+         'hierarchy': hierarchyCore, 'fattree': fatTreeCore}
@@ -0,0 +1,313 @@
+from util import toAdr, PrefixTrie
+from netlink import parseRoute
+from collections import OrderedDict
+import os
+import re
+import select
+
+# Command line of a Channel (see channel.Channel.send)
+STATUS = re.compile(r'^(.*); printf "\\036%d" \$\?$')
+
+class FakeIntf(object):
+    def __init__(self, name, node):
+        self.name = name
+        self.node = node
+        self.ip = None
+        self.prefixLen = None
+
+    def IP(self):
+        return self.ip
+
+    def __repr__(self):
+        return self.name
+
+class FakeNode(object):
+    """In-memory stand-in for a Mininet node. Commands are not run but
+       recorded and interpreted: routes and addresses set with 'ip' end up in
+       the routing table of the node, pings are answered from the routing
+       tables of the whole network (see FakeNet.reachable()) and every other
+       command succeeds without output.
+       The shell is a pipe that answers writes right away, so Channel and
+       parallel.fanOut() work with fake nodes as they do with real ones."""
+    def __init__(self, name, net, isSwitch=False, isNAT=False, **params):
+        self.name = name
+        self.net = net
+        self.params = params
+        self.isSwitch = isSwitch
+        self.isNAT = isNAT
+        self.intfs = OrderedDict() # name -> FakeIntf
+        self.routes = OrderedDict() # a.b.c.d/x or 'default' -> [(gateway, intf)]
+        self.commands = []
+        self.trie = None # Routing table, built on lookup
+        self.pid = None
+        self.shell = True
+        self.waiting = False
+        self.readbuf = ''
+        self.out = ''
+        self.signaled = False
+        self.rfd, self.wfd = os.pipe()
+        self.stdout = os.fdopen(self.rfd, 'rb', 0)
+        self.pollOut = select.poll()
+        self.pollOut.register(self.rfd, select.POLLIN)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+    def addIntf(self, name):
+        intf = self.intfs[name] = FakeIntf(name, self)
+        return intf
+
+    def intf(self, name=None):
+        if name is None:
+            return self.defaultIntf()
+        return self.intfs[name]
+
+    def intfList(self):
+        return list(self.intfs.values())
+
+    def defaultIntf(self):
+        return next(iter(self.intfs.values()), None)
+
+    def IP(self):
+        intf = self.defaultIntf()
+        return intf.ip if intf is not None else None
+
+    def setIP(self, ip, intf):
+        # ip: a.b.c.d/x
+        adr, prefixLen = ip.split('/')
+        intf = self.intfs[str(intf)]
+        intf.ip, intf.prefixLen = adr, int(prefixLen)
+        self.trie = None
+        self.net.index = None
+
+    # Shell
+
+    def cmd(self, *args, **kwargs):
+        return self.run(' '.join(str(arg) for arg in args))[0]
+
+    def write(self, data):
+        # Commands written by a Channel, one per line
+        for line in data.splitlines():
+            match = STATUS.match(line)
+            output, status = self.run(match.group(1) if match else line)
+            if match:
+                output += '\036%d' % status
+            self.out += output + chr(127)
+        if self.out and not self.signaled:
+            os.write(self.wfd, b'.')
+            self.signaled = True
+
+    def read(self, size=1024):
+        data, self.out = self.out[:size], self.out[size:]
+        if not self.out and self.signaled:
+            os.read(self.rfd, 1)
+            self.signaled = False
+        return data
+
+    def waitReadable(self, timeoutms=None):
+        return self.pollOut.poll(timeoutms)
+
+    def run(self, cmd):
+        """Interpret a shell command.
+           returns: (output, exit status)"""
+        cmd = cmd.strip()
+        self.commands.append(cmd)
+        self.net.commands.append((self.name, cmd))
+        words = cmd.rstrip('&').split()
+        if words[:3] == ['ip', 'route', 'replace']:
+            self.addRoute(' '.join(words[3:]))
+        elif words[:3] == ['ip', '-force', '-batch']:
+            with open(words[3]) as f:
+                for line in f:
+                    if line.startswith('route replace '):
+                        self.addRoute(line[len('route replace '):])
+        elif words[:3] == ['ip', 'addr', 'replace']:
+            self.setIP(words[3], words[5])
+        elif words[:1] == ['ping']:
+            received = 1 if self.net.reachable(self, words[-1]) else 0
+            return ('1 packets transmitted, %d received, %d%% packet loss\n'
+                    % (received, 100 - 100 * received)), 1 - received
+        return '', 0
+
+    # Routing
+
+    def addRoute(self, spec):
+        dst, hops = parseRoute(spec)
+        self.routes[dst] = hops
+        self.trie = None
+
+    def lookup(self, adr):
+        """Route of the routing table that matches adr
+           returns: list of (gateway or None, intf), None if there is no route"""
+        if self.trie is None:
+            self.trie = PrefixTrie()
+            for dst, hops in self.routes.items():
+                if dst == 'default':
+                    self.trie.insert(0, 0, hops)
+                else:
+                    ip, prefixLen = (dst.split('/') + ['32'])[:2]
+                    self.trie.insert(toAdr(ip), int(prefixLen), hops)
+            # Connected subnets win over static routes of the same prefix
+            for intf in self.intfs.values():
+                if intf.ip is not None:
+                    mask = (0xffffffff << (32 - intf.prefixLen)) & 0xffffffff
+                    self.trie.insert(toAdr(intf.ip) & mask, intf.prefixLen,
+                                     [(None, intf.name)])
+        return self.trie.lookup(adr)
+
+    def owns(self, adr):
+        return any(intf.ip is not None and toAdr(intf.ip) == adr
+                   for intf in self.intfs.values())
+
+class FakeNet(object):
+    """In-memory stand-in for the parts of Mininet that main.buildNetwork()
+       and main.startNetwork() use. Nothing touches the kernel: nodes record
+       the commands they get (see FakeNode), and the addresses and routes
+       they set are enough to answer reachability queries."""
+    simulated = True
+
+    def __init__(self, ipBase=None, **kwargs):
+        self.ipBase = ipBase
+        self.hosts = []
+        self.switches = []
+        self.links = [] # (node1, intf1, node2, intf2)
+        self.nameToNode = OrderedDict()
+        self.commands = [] # (node, cmd) in the order they ran
+        self.index = None  # see segments()
+        self.started = False
+
+    def addNode(self, name, isSwitch=False, **params):
+        node = FakeNode(name, self, isSwitch=isSwitch, **params)
+        (self.switches if isSwitch else self.hosts).append(node)
+        self.nameToNode[name] = node
+        return node
+
+    def addSwitch(self, name, cls=None, **params):
+        return self.addNode(name, isSwitch=True, **params)
+
+    def addHost(self, name, cls=None, **params):
+        return self.addNode(name, **params)
+
+    def addNAT(self, name='nat0', connect=True, inNamespace=False, **params):
+        node = self.addNode(name, isNAT=True, **params)
+        if connect:
+            self.addLink(node, self.switches[0])
+        return node
+
+    def addLink(self, node1, node2, port1=None, port2=None, params1=None, params2=None,
+                **kwargs):
+        if isinstance(node1, str):
+            node1 = self.get(node1)
+        if isinstance(node2, str):
+            node2 = self.get(node2)
+        ends = []
+        for node, port, params in ((node1, port1, params1), (node2, port2, params2)):
+            if port is None:
+                port = len(node.intfs) + (1 if node.isSwitch else 0)
+            intf = node.addIntf('%s-eth%d' % (node.name, port))
+            if params and params.get('ip'):
+                node.setIP(params['ip'], intf)
+            ends.append(intf)
+        self.links.append((node1, ends[0], node2, ends[1]))
+        self.index = None
+        return self.links[-1]
+
+    def get(self, *names):
+        nodes = [self.nameToNode[name] for name in names]
+        return nodes[0] if len(nodes) == 1 else nodes
+
+    def __getitem__(self, name):
+        return self.nameToNode[name]
+
+    def start(self):
+        # Like Mininet, hosts get their ip parameter on their first interface
+        for node in self.hosts:
+            ip = node.params.get('ip')
+            if ip and node.defaultIntf() is not None:
+                node.setIP(ip, node.defaultIntf())
+        self.started = True
+
+    def stop(self):
+        for node in self.hosts + self.switches:
+            node.stdout.close()
+            os.close(node.wfd)
+        self.started = False
+
+    # Reachability
+
+    def segments(self):
+        """Layer 2 segments: interfaces joined by links and switches.
+           returns: {intf: segment}, {segment: {address: (node, intf)}}"""
+        if self.index is None:
+            parent = {}
+            def find(intf):
+                while parent.setdefault(intf, intf) != intf:
+                    parent[intf] = parent[parent[intf]]
+                    intf = parent[intf]
+                return intf
+            for node1, intf1, node2, intf2 in self.links:
+                parent[find(intf1)] = find(intf2)
+            for switch in self.switches:
+                intfs = switch.intfList()
+                for intf in intfs[1:]:
+                    parent[find(intf)] = find(intfs[0])
+            segment = dict((intf, find(intf)) for intf in list(parent))
+            owners = {}
+            for node in self.hosts:
+                for intf in node.intfList():
+                    if intf.ip is not None and intf in segment:
+                        owners.setdefault(segment[intf], {})[toAdr(intf.ip)] = (node, intf)
+            self.index = segment, owners
+        return self.index
+
+    def path(self, src, dst, ttl=64):
+        """Nodes crossed by a packet from src to the address dst, following
+           the first next hop of multipath routes. The NAT gateways send
+           the addresses they have no route for to 'internet'.
+           returns: list of node names ending with the one that owns dst,
+                    None if the packet is dropped"""
+        node = self.get(src) if isinstance(src, str) else src
+        adr = toAdr(dst)
+        segment, owners = self.segments()
+        path = [node.name]
+        for i in range(ttl):
+            if node.owns(adr):
+                return path
+            hops = node.lookup(adr)
+            if hops is None:
+                return path + ['internet'] if node.isNAT else None
+            gateway, intf = hops[0]
+            intf = node.intfs.get(intf)
+            neighbor = owners.get(segment.get(intf), {}).get(
+                adr if gateway is None else toAdr(gateway))
+            if neighbor is None:
+                return None
+            node = neighbor[0]
+            path.append(node.name)
+        return None
+
+    def reachable(self, src, dst):
+        """Whether a ping from node src to the address dst gets its answer:
+           the request reaches dst and the reply finds its way back (the
+           NAT gateways answer for the outside world)"""
+        src = self.get(src) if isinstance(src, str) else src
+        path = self.path(src, dst)
+        if path is None:
+            return False
+        if path[-1] == 'internet':
+            return True
+        return self.path(path[-1], src.IP()) is not None
+
+    def matrix(self, nodes=None):
+        """Reachability between nodes (default: every host)
+           returns: {src: {dst: bool}}"""
+        nodes = [n for n in self.hosts if not n.isSwitch] if nodes is None else nodes
+        return OrderedDict((src.name, OrderedDict((dst.name, self.reachable(src, dst.IP()))
+                                                  for dst in nodes if dst is not src))
+                           for src in nodes)
+
+    def routes(self, name):
+        # Routing table of a node as 'ip route' lines
+        node = self.get(name)
+        return ['%s %s' % (dst, ' '.join('via %s dev %s' % hop for hop in hops))
+                for dst, hops in node.routes.items()]
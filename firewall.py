@@ -0,0 +1,228 @@
+from mininet.log import error
+from collections import OrderedDict
+from util import runBatch
+
+class Ruleset(object):
+    """iptables rules of a node, grouped by table.
+       The whole ruleset is installed with a single iptables-restore
+       --noflush call, which commits every table atomically instead of
+       rewriting it once per rule."""
+    def __init__(self):
+        self.tables = OrderedDict() # table -> [(insert, chain, rule)]
+        self.chains = {} # table -> [user defined chain]
+
+    def addChain(self, table, chain):
+        # Create (or flush, if it already exists) a user defined chain
+        self.tables.setdefault(table, [])
+        self.chains.setdefault(table, []).append(chain)
+
+    def add(self, table, chain, rule, insert=False):
+        """table, chain: where the rule goes ('filter', 'FORWARD')
+           rule: iptables rule specification ('-s 10.0.0.0/8 -j ACCEPT')
+           insert: insert the rule at the top of the chain instead of appending it"""
+        self.tables.setdefault(table, []).append((insert, chain, rule))
+
+    def __len__(self):
+        # Number of rules, jumps to the user defined chains included
+        return sum(len(rules) for rules in self.tables.values())
+
+    def payload(self):
+        # iptables-restore input that adds every rule
+        lines = []
+        for table, rules in self.tables.items():
+            lines.append('*' + table)
+            lines.extend(':%s - [0:0]' % chain for chain in self.chains.get(table, []))
+            for insert, chain, rule in rules:
+                lines.append(' '.join(('-I' if insert else '-A', chain, rule)))
+            lines.append('COMMIT')
+        return lines
+
+    def install(self, node):
+        output = runBatch(node, 'iptables-restore --noflush', self.payload())
+        if output.strip():
+            error('*** iptables-restore failed on', node.name + ':', output)
+
+class Firewall(object):
+    """NAT and port forwarding rules of the NAT node.
+       Subclasses generate the rules for one packet filter backend and
+       commit them with a single atomic command."""
+    def __init__(self, intfs):
+        """intfs: local interfaces of the NAT gateway (facing the routers)"""
+        self.intfs = list(intfs)
+        self.subnets = []
+        self.uplinks = []  # (intf, subnet)
+        self.forwards = [] # (inIntf, proto, port, dest)
+
+    def addNAT(self, subnets):
+        """Let the local subnets reach the outside world through the NAT,
+           but not each other through the NAT.
+           subnets: a.b.c.d/x addresses of the local subnets"""
+        self.subnets.extend(subnets)
+
+    def addUplink(self, intf, subnet):
+        """Let another NAT gateway reach the outside world through this one.
+           intf: interface of the link to the gateway
+           subnet: a.b.c.d/x address of the link"""
+        self.uplinks.append((intf, subnet))
+
+    def addDNAT(self, inIntf, proto, port, dest):
+        # Forward incoming proto/port packets of inIntf to dest (a.b.c.d:port)
+        self.forwards.append((inIntf, proto, port, dest))
+
+    def lines(self):
+        # Input of the command that installs the rules
+        raise NotImplementedError
+
+    def __len__(self):
+        # Number of rules installed
+        raise NotImplementedError
+
+    def install(self, node):
+        raise NotImplementedError
+
+    def remove(self, node):
+        self.purge(node)
+
+    @classmethod
+    def checkDNATCommand(cls, inIntf, proto, port, dest):
+        # Shell command that fails unless the DNAT rule of addDNAT() is installed
+        raise NotImplementedError
+
+    @classmethod
+    def purge(cls, node):
+        """Remove every rule of the backend from node, including the ones
+           left behind by previous runs that didn't finish cleanly"""
+        node.cmd(cls.purgeCommand())
+
+    @classmethod
+    def purgeCommand(cls):
+        # Shell command that purges the rules (see purge())
+        raise NotImplementedError
+
+class IptablesFirewall(Firewall):
+    """Firewall rules as an iptables Ruleset.
+       The rules live in dedicated chains that are jumped to from the
+       built-in ones, so removing them is a matter of deleting the jumps
+       and flushing and deleting the chains, however many rules they have."""
+    # (table, built-in chain, dedicated chain)
+    chains = [('filter', 'FORWARD', 'MN-FORWARD'),
+              ('nat', 'POSTROUTING', 'MN-POSTROUTING'),
+              ('nat', 'PREROUTING', 'MN-PREROUTING')]
+
+    def ruleset(self):
+        ruleset = Ruleset()
+        for table, hook, chain in self.chains:
+            ruleset.addChain(table, chain)
+            ruleset.add(table, hook, '-j ' + chain, insert=True)
+        for intf in self.intfs:
+            for subnet in self.subnets:
+                ruleset.add('filter', 'MN-FORWARD', '-i %s -d %s -j DROP' % (intf, subnet))
+        for subnet in self.subnets:
+            for intf in self.intfs:
+                ruleset.add('filter', 'MN-FORWARD', '-i %s -s %s -j ACCEPT' % (intf, subnet))
+                ruleset.add('filter', 'MN-FORWARD', '-o %s -d %s -j ACCEPT' % (intf, subnet))
+            ruleset.add('nat', 'MN-POSTROUTING', '-s %s ! -d %s -j MASQUERADE' % (subnet, subnet))
+        for intf, subnet in self.uplinks:
+            ruleset.add('filter', 'MN-FORWARD', '-i %s -s %s -j ACCEPT' % (intf, subnet))
+            ruleset.add('filter', 'MN-FORWARD', '-o %s -d %s -j ACCEPT' % (intf, subnet))
+            ruleset.add('nat', 'MN-POSTROUTING', '-s %s -j MASQUERADE' % subnet)
+        for inIntf, proto, port, dest in self.forwards:
+            ruleset.add('nat', 'MN-PREROUTING', '-i %s -p %s --dport %d -j DNAT --to %s'
+                        % (inIntf, proto, port, dest))
+        return ruleset
+
+    def lines(self):
+        return self.ruleset().payload()
+
+    def __len__(self):
+        return len(self.ruleset())
+
+    def install(self, node):
+        self.ruleset().install(node)
+
+    @classmethod
+    def checkDNATCommand(cls, inIntf, proto, port, dest):
+        return ('iptables -t nat -C MN-PREROUTING -i %s -p %s --dport %d -j DNAT '
+                '--to-destination %s' % (inIntf, proto, port, dest))
+
+    @classmethod
+    def purgeCommand(cls):
+        cmds = []
+        for table, hook, chain in cls.chains:
+            args = (table, hook, chain)
+            cmds.append('while iptables -t %s -D %s -j %s 2>/dev/null; do :; done' % args)
+            cmds.append('iptables -t %s -F %s 2>/dev/null' % args[::2])
+            cmds.append('iptables -t %s -X %s 2>/dev/null' % args[::2])
+        return '; '.join(cmds)
+
+class NftFirewall(Firewall):
+    """Firewall rules in a dedicated nftables table.
+       All the local subnets go into one interval set, so every hook has a
+       constant number of rules no matter how many subnets there are.
+       Note that packets still have to get through the iptables FORWARD
+       policy of the NAT node."""
+    table = 'mininet_nat'
+
+    def chains(self):
+        # chain -> (hook specification, [rule])
+        intfs = ', '.join('"%s"' % intf for intf in self.intfs)
+        if len(self.intfs) > 1:
+            intfs = '{ %s }' % intfs
+        chains = OrderedDict()
+        chains['forward'] = ('type filter hook forward priority 0; policy accept;',
+                             ['iifname %s ip daddr @lans drop' % intfs,
+                              'iifname %s ip saddr @lans accept' % intfs,
+                              'oifname %s ip daddr @lans accept' % intfs])
+        chains['postrouting'] = ('type nat hook postrouting priority 100; policy accept;',
+                                 ['ip saddr @lans ip daddr != @lans masquerade'])
+        for intf, subnet in self.uplinks:
+            chains['forward'][1].extend(['iifname "%s" ip saddr %s accept' % (intf, subnet),
+                                         'oifname "%s" ip daddr %s accept' % (intf, subnet)])
+            chains['postrouting'][1].append('ip saddr %s masquerade' % subnet)
+        chains['prerouting'] = ('type nat hook prerouting priority -100; policy accept;',
+                                [self.dnatRule(*forward) for forward in self.forwards])
+        return chains
+
+    @staticmethod
+    def dnatRule(inIntf, proto, port, dest):
+        return 'iifname "%s" %s dport %d dnat to %s' % (inIntf, proto, port, dest)
+
+    def lines(self):
+        # nft -f input that (re)creates the whole table
+        lans = ', '.join(self.subnets)
+        lines = ['table ip %s' % self.table, # Make sure the table exists
+                 'delete table ip %s' % self.table, # before replacing it
+                 'table ip %s {' % self.table,
+                 '    set lans {',
+                 '        type ipv4_addr',
+                 '        flags interval']
+        if lans:
+            lines.append('        elements = { %s }' % lans)
+        lines.append('    }')
+        for chain, (hook, rules) in self.chains().items():
+            lines += ['    chain %s {' % chain, '        ' + hook]
+            lines += ['        ' + rule for rule in rules]
+            lines.append('    }')
+        lines.append('}')
+        return lines
+
+    def __len__(self):
+        return sum(len(rules) for hook, rules in self.chains().values())
+
+    def install(self, node):
+        output = runBatch(node, 'nft -f', self.lines())
+        if output.strip():
+            error('*** nft failed on', node.name + ':', output)
+
+    @classmethod
+    def checkDNATCommand(cls, inIntf, proto, port, dest):
+        # nft lists the rules as they were written
+        return "nft list chain ip %s prerouting | grep -qF '%s'" % (
+            cls.table, cls.dnatRule(inIntf, proto, port, dest))
+
+    @classmethod
+    def purgeCommand(cls):
+        return 'nft delete table ip %s 2>/dev/null' % cls.table
+
+# Firewall backends that can be selected from the command line
+FIREWALLS = {'iptables': IptablesFirewall, 'nftables': NftFirewall}
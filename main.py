@@ -4,112 +4,269 @@ from mininet.net import Mininet
 from mininet.node import Host, Node
 from mininet.node import OVSKernelSwitch
 from mininet.cli import CLI
-from mininet.log import setLogLevel, info
-from mininet.util import irange
-from util import Network
+from mininet.log import setLogLevel, info, error
+from firewall import FIREWALLS
+from routing import routeCommand, hashPolicyCommand, rpFilterCommand, HASH_POLICIES
+from cores import CORES
+from plan import compilePlan, cachedPlan
+from parallel import addNodes, addLinks, fanOut
+from channel import Channel
+from metrics import Metrics, FORMATS
+from tracing import Tracer
+from verify import verifyNetwork, showMatrix
+import netlink
+import os
 
-def NATNetwork(nrouters=2, nhosts=3, server=False):
-    """nrouters: number of local subnets to build (each one has 1 router)
-       nhosts: number of hosts per local subnet"""
-    netN = Network('172.16.0.0/16')
-    netR = Network('10.10.10.0/24')
-    netH = Network('192.168.0.0/16', nextSubnet='192.168.1.0')
+def buildNetwork(plan, workers=None, linkIPs=True, metrics=None, netClass=Mininet):
+    """Create the nodes and links of a plan (see plan.compilePlan).
+       workers: create up to this many switches, routers, hosts and links
+                at the same time (None: one after another)
+       linkIPs: set the addresses of the routers and of the uplinks of the
+                NAT gateways while creating their links
+                (False: leave them to configureNodes())
+       metrics: Metrics that times each step (see metrics.Metrics)
+       netClass: Mininet, or fakenet.FakeNet to simulate the network
+       Returns the Mininet network, not started yet."""
+    net = netClass(ipBase=plan.ipBase)
+    metrics = metrics or Metrics()
+    if getattr(net, 'simulated', False):
+        workers = None # Simulated nodes are created in memory, one by one
+
+    def addAll(nodes):
+        if workers:
+            addNodes(net, nodes, workers)
+        else:
+            for name, cls, params, isSwitch in nodes:
+                if isSwitch:
+                    net.addSwitch(name, cls=cls, **params)
+                else:
+                    net.addHost(name, cls=cls, **params)
 
-    net = Mininet(ipBase=netN.ip)
+    def linkAll(links):
+        links = [(name1, port1, name2, port2,
+                  {} if ip1 is None or not linkIPs else {'ip':ip1},
+                  {} if ip2 is None or not linkIPs else {'ip':ip2})
+                 for name1, port1, ip1, name2, port2, ip2 in links]
+        if workers:
+            addLinks(net, links, workers)
+        else:
+            for name1, port1, name2, port2, params1, params2 in links:
+                net.addLink(net.get(name1), net.get(name2), port1=port1, port2=port2,
+                            params1=params1, params2=params2)
 
     info( '*** Adding switches\n')
-    for i in irange(0, nrouters):
-        net.addSwitch('s%d' % i, cls=OVSKernelSwitch, failMode='standalone')
+    with metrics.phase('switches'):
+        addAll([(name, OVSKernelSwitch, {'failMode':'standalone'}, True)
+                for name in plan.switches])
 
     info( '*** Adding NAT\n')
-    nat = net.addNAT('nat', connect=None, ip=netN.giveIP('nat'), flush=True)
-    net.addLink(net.get('s0'), nat, port2=0)
+    with metrics.phase('nat'):
+        for i, (name, ip, flush) in enumerate(plan.nats):
+            net.addNAT(name, connect=None, ip=ip, flush=flush, inNamespace=i > 0)
+        # Remove the rules left by runs that didn't finish cleanly. Only the
+        # first gateway is in the root namespace, see plan.compilePlan
+        channel = Channel(net.get(plan.nats[0][0]))
+        for backend in FIREWALLS.values():
+            channel.add(backend.purgeCommand())
+        channel.run()
 
     info( '*** Adding routers\n')
-    for i in irange(1, nrouters):
-        subnet = netH.addSubnet(minHosts=max(254, nhosts))
-        r = net.addHost('r%d' % i, cls=Node, ip=None)
-        net.addLink(net.get('s0'), r, params2={'ip':netN.giveIP(r.name)}, port2=0)
-        net.addLink(net.get('s%d'%i), r, params2={'ip':subnet.giveIP(r.name)}, port2=i)
-
-    # Connect all routers between them in a mesh topology
-    for i in irange(1, nrouters):
-        for j in irange(i+1, nrouters):
-            subnet = netR.addSubnet(minHosts=2)
-            net.addLink(net.get('r%d'%i), net.get('r%d'%j),
-                params1={'ip':subnet.giveIP('r%d'%i)}, port1=j,
-                params2={'ip':subnet.giveIP('r%d'%j)}, port2=i)
+    with metrics.phase('routers'):
+        addAll([(name, Node, {'ip':None}, False) for name in plan.routers + plan.transit])
+
+    info( '*** Adding links\n')
+    hosts = set(name for name, ip in plan.hosts)
+    with metrics.phase('links'):
+        linkAll([link for link in plan.links if link[0] not in hosts])
 
     info( '*** Adding hosts\n')
-    n = 0
-    for i in irange(1, nrouters):
-        for j in irange(1, nhosts):
-            n += 1
-            h = net.addHost('h%d'%n, cls=Host, ip=netH.subnets[i-1].giveIP('h%d'%n))
-            net.addLink(h, net.get('s%d'%i), port1=0)
+    with metrics.phase('hosts'):
+        addAll([(name, Host, {'ip':ip}, False) for name, ip in plan.hosts])
+        linkAll([link for link in plan.links if link[0] in hosts])
+    return net
+
+def configureNodes(net, plan, useNetlink=False, metrics=None):
+    """Set the default and static routes of the plan, the ECMP hash policy
+       and start the Flask server.
+       useNetlink: set the routes and the link addresses of the routers and
+                   NAT gateways over netlink (see netlink.configure())
+                   instead of running 'ip' in each node. Nodes netlink
+                   can't configure fall back to their shell.
+       metrics: Metrics that times each step (see metrics.Metrics)"""
+    metrics = metrics or Metrics()
+    with metrics.phase('routes'):
+        configureRoutes(net, plan, useNetlink)
+    if plan.server is not None:
+        h = net.get(plan.server)
+        info( '*** Executing Flask server on host %s (in the background).\n'
+              '    Server output will be redirected to Flask1.log\n' % h.name)
+        with metrics.phase('server'):
+            fanOut([(h, 'python Flask1.py --ip %s > Flask1.log 2>&1 &' % h.IP())])
+
+def configureRoutes(net, plan, useNetlink):
+    # Nodes with addresses on their links (the NAT gateways on their uplinks)
+    linked = set(plan.routers + plan.transit + [name for name, ip, flush in plan.nats])
+    addresses = dict((name, intfs) for name, intfs in plan.addresses().items()
+                     if name in linked)
+    nodes = [(net.get(name), addresses.get(name, []) if useNetlink else [], routes)
+             for name, routes in plan.routes.items()]
+    if useNetlink:
+        info('*** Configuring addresses and routes over netlink\n')
+        nodes = netlink.configure(nodes)
+        # Mininet didn't set these addresses, so it doesn't know them yet
+        for name, intfs in addresses.items():
+            for intf, ip in intfs:
+                intf = net.get(name).intf(intf)
+                intf.ip, intf.prefixLen = ip.split('/')[0], int(ip.split('/')[1])
+
+    info('*** Configuring default and static routes\n')
+    # Nodes are independent, so they are all configured at the same time
+    commands, batches = [], []
+    for node, intfs, routes in nodes:
+        for intf, ip in intfs:
+            commands.append((node, 'ip addr replace %s dev %s' % (ip, intf)))
+        if not routes:
+            continue
+        cmd, batch = routeCommand(routes)
+        commands.append((node, cmd))
+        if batch is not None:
+            batches.append(batch)
+    if len(plan.nats) > 1:
+        gateways = plan.addresses()
+        for name, ip, flush in plan.nats:
+            intfs = [intf for intf, intfIP in gateways[name]]
+            commands.append((net.get(name), rpFilterCommand(intfs)))
+    if plan.hashPolicy is not None:
+        for name in plan.routers + plan.transit:
+            commands.append((net.get(name), hashPolicyCommand(plan.hashPolicy)))
+    try:
+        results = fanOut(commands)
+    finally:
+        for batch in batches:
+            os.remove(batch)
+    for node, output, status in results:
+        if status or output.strip():
+            error('*** Configuring', node.name, 'failed:', output, '\n')
+
+def NATNetwork(nrouters=2, nhosts=3, server=False, firewall='iptables', core='mesh',
+               ecmp=None, nnats=1, dryRun=None, cache=True, workers=None,
+               useNetlink=False, metrics=None, metricsFormat='json', trace=None,
+               verify=False, verifyPairs=None):
+    """nrouters: number of local subnets to build (each one has 1 router)
+       nhosts: number of hosts per local subnet, or a list with the number
+               of hosts of each local subnet
+       firewall: backend of the NAT rules ('iptables' or 'nftables')
+       core: topology that interconnects the routers (see cores.CORES)
+       ecmp: hash policy of multipath routes over equal cost paths of the
+             core (see routing.HASH_POLICIES), None to use a single path
+       nnats: number of NAT gateways. Routers are spread between them, or
+              use all of them with multipath default routes if ecmp is set
+              (see plan.compilePlan)
+       dryRun: don't build the network, export its plan as JSON to this
+               file instead ('-': standard output)
+       cache: reuse the plan compiled by a previous run with the same
+              parameters (see plan.cachedPlan)
+       workers: number of nodes and links created at the same time while
+                building the network (None: one after another)
+       useNetlink: set addresses and routes over netlink (needs pyroute2)
+                   instead of running 'ip' in every node
+       metrics: write the wall time and the number of node commands of each
+                phase of the run to this file ('-': standard output)
+       metricsFormat: format of the metrics (see metrics.FORMATS)
+       trace: record every command run in the nodes and write them to this
+              file, for chrome://tracing or Perfetto (see tracing.Tracer)
+       verify: check the connectivity of the network once it is configured,
+               with concurrent pings between a sample of the hosts (see
+               verify.verifyNetwork)
+       verifyPairs: check at most this many random pairs of local subnets"""
+    stats = Metrics()
+    params = dict(nrouters=nrouters, nhosts=nhosts, server=server,
+                  firewall=firewall, core=core, ecmp=ecmp, nnats=nnats)
+    with stats.phase('plan'):
+        plan = cachedPlan(**params) if cache else compilePlan(**params)
+    if plan is None:
+        return
+    if dryRun is not None:
+        plan.export(dryRun)
+        return
+
+    tracer = Tracer()
+    stats.start()
+    if trace is not None:
+        tracer.start()
+    try:
+        runNetwork(plan, workers, useNetlink, stats, verify, verifyPairs)
+    finally:
+        tracer.stop()
+        stats.stop()
+        if trace is not None:
+            tracer.show()
+            tracer.export(trace)
+        if metrics is not None:
+            stats.export(metrics, metricsFormat)
+
+def startNetwork(plan, workers=None, useNetlink=False, metrics=None, netClass=Mininet):
+    """Build, start and configure the network of plan (see NATNetwork for
+       the parameters, and buildNetwork for netClass).
+       Returns the Mininet network and the NAT rules of each gateway (see
+       stopNetwork())."""
+    metrics = metrics or Metrics()
+    if useNetlink and not netlink.available():
+        info('*** pyroute2 is not installed, configuring nodes through their shell\n')
+        useNetlink = False
+    if getattr(netClass, 'simulated', False):
+        useNetlink = False
+    net = buildNetwork(plan, workers, linkIPs=not useNetlink, metrics=metrics,
+                       netClass=netClass)
 
     info( '*** Topology created:\n')
-    netN.show()
-    netR.show()
-    netH.show()
+    plan.show()
 
     info( '*** Starting network\n')
-    net.start()
-
-    info('*** Configuring default routes\n')
-    n = 0
-    for i in irange(1, nrouters):
-        r = net.get('r%d'%i)
-        r.setDefaultRoute('dev ' + r.intfs[0].name + ' via ' + nat.IP())
-        for j in irange(1, nhosts):
-            n += 1
-            h = net.get('h%d'%n)
-            h.setDefaultRoute('dev '+ h.intfs[0].name+ ' via '+ r.intfs[i].IP())
-
-    info( '*** Configuring static routes\n')
-    for i in irange(1, nrouters):
-        ri = net.get('r%d'%i)
-        nat.cmd('ip route add ' + netH.subnets[i-1].ip + ' via ' +
-                 ri.intfs[0].IP() + ' dev ' + nat.intfs[0].name)
-        for j in irange(1,i-1) + irange(i+1, nrouters):
-            rj = net.get('r%d'%j)
-            ri.cmd('ip route add ' + netH.subnets[j-1].ip + ' via ' +
-                    rj.intfs[i].IP() + ' dev ' + ri.intfs[j].name)
+    with metrics.phase('start'):
+        net.start()
+
+    configureNodes(net, plan, useNetlink, metrics)
 
     info( '*** Configuring NAT rules\n')
-    for subnet in netH.subnets:
-        nat.cmd( 'iptables -I FORWARD','-i', nat.intfs[0], '-d', subnet.ip, '-j DROP' )
-        nat.cmd( 'iptables -A FORWARD','-i', nat.intfs[0], '-s', subnet.ip, '-j ACCEPT' )
-        nat.cmd( 'iptables -A FORWARD','-o', nat.intfs[0], '-d', subnet.ip, '-j ACCEPT' )
-        nat.cmd( 'iptables -t nat -A POSTROUTING','-s', subnet.ip, "'!'", '-d', subnet.ip,'-j MASQUERADE' )
-
-    if server is True:
-        i = 1
-        info( '*** Executing Flask server on host h%d (in the background).\n'
-              '    Server output will be redirected to Flask1.log\n' % i)
-        net.get('h%d'%i).cmd('python Flask1.py --ip', net.get('h%d'%i).IP(),
-                             '> Flask1.log 2>&1 &')
-
-        info( '*** Configuring NAT to forward incoming tcp packets with\n'
-              '    destination port 5200 to %s:5200\n' % net.get('h%d'%i).IP())
-        nat.cmd('iptables -t nat -A PREROUTING', '-i', 'enp0s3', '-p tcp',
-                '--dport 5200 -j DNAT', '--to %s:5200' % net.get('h%d'%i).IP())
-
-    # info( "*** Testing network connectivity\n" )
-    # net.pingAll()
+    for inIntf, proto, port, dest in plan.forwards:
+        info( '*** Configuring NAT to forward incoming %s packets with\n'
+              '    destination port %d to %s\n' % (proto, port, dest))
+    with metrics.phase('rules'):
+        rules = plan.rules()
+        for name, firewall in rules.items():
+            firewall.install(net.get(name))
 
     info( '*** Network is fully configured\n')
-    CLI(net)
+    return net, rules
+
+def stopNetwork(net, plan, rules, metrics=None):
+    # Remove the NAT rules and stop the network started by startNetwork()
+    metrics = metrics or Metrics()
     info( '*** Removing NAT rules\n')
-    for subnet in netH.subnets:
-        nat.cmd( 'iptables -D FORWARD','-i', nat.intfs[0], '-d', subnet.ip, '-j DROP' )
-        nat.cmd( 'iptables -D FORWARD','-i', nat.intfs[0], '-s', subnet.ip, '-j ACCEPT' )
-        nat.cmd( 'iptables -D FORWARD','-o', nat.intfs[0], '-d', subnet.ip, '-j ACCEPT' )
-        nat.cmd( 'iptables -t nat -D POSTROUTING','-s', subnet.ip, "'!'", '-d', subnet.ip,'-j MASQUERADE' )
-    if server is True:
-        nat.cmd('iptables -t nat -D PREROUTING', '-i', 'enp0s3', '-p tcp',
-                '--dport 5200 -j DNAT', '--to %s:5200' % net.get('h%d'%i).IP())
-    net.stop()
+    with metrics.phase('teardown'):
+        for name, firewall in rules.items():
+            firewall.remove(net.get(name))
+        net.stop()
+
+def runNetwork(plan, workers, useNetlink, stats, verify=False, verifyPairs=None):
+    # Build, configure and start the network of plan, tear it down when the CLI exits
+    net, rules = startNetwork(plan, workers, useNetlink, stats)
+    try:
+        if verify:
+            info( "*** Testing network connectivity\n" )
+            with stats.phase('verify'):
+                ok, matrix = verifyNetwork(net, plan, maxPairs=verifyPairs)
+            showMatrix(matrix, plan)
+            if not ok:
+                error('*** The network is not fully reachable\n')
+        CLI(net)
+    finally:
+        stopNetwork(net, plan, rules, stats)
+
+def hostCounts(value):
+    # Parse the --nhosts argument: '3' or '3,10,1'
+    return [int(n) for n in value.split(',')]
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
@@ -118,8 +275,51 @@ if __name__ == '__main__':
 
     parser.add_argument("-N","--nrouters",dest="nrouters", default=2, type=int,
                         help="Number of routers to add to the topology. Default: 2")
-    parser.add_argument("-n","--nhosts",dest="nhosts", default=3, type=int,
-                        help="Number of hosts to add to each router. Default: 3")
+    parser.add_argument("-n","--nhosts",dest="nhosts", default=[3], type=hostCounts,
+                        help="Number of hosts to add to each router, or a comma "
+                        "separated list with the number of hosts of each router. Default: 3")
+    parser.add_argument("-f","--firewall",dest="firewall", default='iptables',
+                        choices=sorted(FIREWALLS),
+                        help="Backend used for the NAT rules. Default: iptables")
+    parser.add_argument("--ecmp",dest="ecmp", default=None, choices=sorted(HASH_POLICIES),
+                        help="Use multipath routes over equal cost paths of the core, "
+                        "hashing packets with the given policy. Default: single path")
+    parser.add_argument("--nats",dest="nnats", default=1, type=int,
+                        help="Number of NAT gateways the routers send their traffic to "
+                        "(see plan.compilePlan). Default: 1")
+    parser.add_argument("--dry-run",dest="dryRun", nargs='?', const='-', default=None,
+                        metavar="FILE", help="Don't build the network, write its plan "
+                        "(nodes, links, addresses, routes and NAT rules) as JSON to FILE "
+                        "or to the standard output")
+    parser.add_argument("--no-cache",dest="cache", action='store_false',
+                        help="Compile the plan of the network even if a previous run "
+                        "already compiled it with the same parameters")
+    parser.add_argument("-w","--workers",dest="workers", default=None, type=int,
+                        help="Create up to WORKERS nodes and links at the same time. "
+                        "Default: one after another")
+    parser.add_argument("--netlink",dest="useNetlink", action='store_true',
+                        help="Set addresses and routes over netlink instead of running "
+                        "'ip' in every node (needs pyroute2)")
+    parser.add_argument("--metrics",dest="metrics", default=None, metavar="FILE",
+                        help="Write the wall time and the number of node commands of "
+                        "each phase of the run to FILE ('-': standard output)")
+    parser.add_argument("--metrics-format",dest="metricsFormat", default='json',
+                        choices=FORMATS, help="Format of --metrics. Default: json")
+    parser.add_argument("--trace",dest="trace", default=None, metavar="FILE",
+                        help="Record every command run in the nodes, with its wall time "
+                        "and output size, and write them to FILE in the format of "
+                        "chrome://tracing")
+    parser.add_argument("--verify",dest="verify", action='store_true',
+                        help="Check the connectivity of the network before the CLI, "
+                        "pinging between a host of every pair of local subnets and "
+                        "from every local subnet to the outside at the same time, "
+                        "checking the DNAT rule of the Flask server and connecting "
+                        "to it from the NAT")
+    parser.add_argument("--verify-pairs",dest="verifyPairs", default=None, type=int,
+                        help="With --verify, check at most this many random pairs of "
+                        "local subnets")
+    parser.add_argument("--core",dest="core", default='mesh', choices=sorted(CORES),
+                        help="Topology that interconnects the routers. Default: mesh")
     server_flag.add_argument("-s","--server",dest="flag", action='store_true',
                         help="Execute a flask server in on of the hosts")
     server_flag.add_argument("-c","--client",dest="flag", action='store_false',
@@ -127,6 +327,17 @@ if __name__ == '__main__':
 
     parser.set_defaults(flag=False)
     args = parser.parse_args()
+    if len(args.nhosts) == 1:
+        args.nhosts = args.nhosts * args.nrouters
+    elif len(args.nhosts) != args.nrouters:
+        parser.error("--nhosts must give 1 or %d host counts" % args.nrouters)
+    if args.nnats < 1:
+        parser.error("--nats must be at least 1")
 
     setLogLevel( 'info' )
-    NATNetwork(nrouters=args.nrouters, nhosts=args.nhosts, server=args.flag)
+    NATNetwork(nrouters=args.nrouters, nhosts=args.nhosts, server=args.flag,
+               firewall=args.firewall, core=args.core, ecmp=args.ecmp, nnats=args.nnats,
+               dryRun=args.dryRun, cache=args.cache, workers=args.workers,
+               useNetlink=args.useNetlink, metrics=args.metrics,
+               metricsFormat=args.metricsFormat, trace=args.trace,
+               verify=args.verify, verifyPairs=args.verifyPairs)
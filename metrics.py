@@ -0,0 +1,82 @@
+from mininet.node import Node
+from channel import Channel
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+class Metrics(object):
+    """Wall time and number of node commands of each phase of a run.
+       While started, every command sent to the shell of a node (with
+       sendCmd(), so cmd() too, or through a Channel) is counted in the
+       current phase."""
+    def __init__(self, run='natnetwork'):
+        self.run = run
+        self.phases = OrderedDict() # name -> [seconds, commands]
+        self.commands = 0
+        self.saved = None
+
+    def start(self):
+        metrics = self
+        sendCmd, send = Node.sendCmd, Channel.send
+        def countedSendCmd(node, *args, **kwargs):
+            metrics.commands += 1
+            return sendCmd(node, *args, **kwargs)
+        def countedSend(channel):
+            metrics.commands += len(channel.cmds)
+            return send(channel)
+        self.saved = sendCmd, send
+        Node.sendCmd, Channel.send = countedSendCmd, countedSend
+
+    def stop(self):
+        if self.saved is not None:
+            Node.sendCmd, Channel.send = self.saved
+            self.saved = None
+
+    @contextmanager
+    def phase(self, name):
+        # Time the body of the with statement as phase name
+        start, commands = time.time(), self.commands
+        try:
+            yield
+        finally:
+            seconds, count = self.phases.get(name, (0.0, 0))
+            self.phases[name] = [seconds + time.time() - start,
+                                 count + self.commands - commands]
+
+    def asDict(self):
+        return OrderedDict([
+            ('run', self.run),
+            ('seconds', sum(seconds for seconds, commands in self.phases.values())),
+            ('commands', self.commands),
+            ('phases', OrderedDict((name, OrderedDict([('seconds', seconds),
+                                                       ('commands', commands)]))
+                                   for name, (seconds, commands) in self.phases.items()))])
+
+    def prometheus(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric, help, index in (('seconds', 'Wall time of each phase', 0),
+                                    ('commands', 'Node commands issued in each phase', 1)):
+            name = '%s_phase_%s' % (self.run, metric)
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for phase, values in self.phases.items():
+                lines.append('%s{phase="%s"} %s' % (name, phase, values[index]))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, filename='-', fmt='json'):
+        # Write the metrics to filename ('-': standard output), fmt: 'json' or 'prometheus'
+        if fmt == 'json':
+            text = json.dumps(self.asDict(), indent=1) + '\n'
+        else:
+            text = self.prometheus()
+        if filename == '-':
+            sys.stdout.write(text)
+        else:
+            with open(filename, 'w') as f:
+                f.write(text)
+
+# Formats of Metrics.export()
+FORMATS = ('json', 'prometheus')
@@ -0,0 +1,108 @@
+from mininet.log import info
+import ctypes
+import os
+
+# pyroute2 is optional, without it nodes are configured through their shell
+try:
+    from pyroute2 import IPRoute
+    from pyroute2.netlink.exceptions import NetlinkError
+except ImportError:
+    IPRoute = None
+
+CLONE_NEWNET = 0x40000000
+
+def available():
+    return IPRoute is not None
+
+def setns(fd):
+    # Move the calling thread to the network namespace of the open file fd
+    if hasattr(os, 'setns'):
+        os.setns(fd, CLONE_NEWNET)
+    else:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.setns(fd, CLONE_NEWNET) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+def parseRoute(spec):
+    """Arguments of IPRoute.route() for an 'ip route' specification
+       (see routing.route() and routing.multipathRoute())
+       returns: (dst, [(gateway, intf)])"""
+    words = spec.split()
+    dst, hops = words[0], []
+    for i, word in enumerate(words):
+        if word == 'via':
+            hops.append((words[i+1], None))
+        elif word == 'dev':
+            hops[-1] = (hops[-1][0], words[i+1])
+    return dst, hops
+
+class Session(object):
+    """Netlink socket in the network namespace of a node. Opening it only
+       switches namespaces for a moment: the socket keeps talking to the
+       namespace it was created in."""
+    def __init__(self, node):
+        self.node = node
+        root = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+        ns = None
+        try:
+            ns = os.open('/proc/%d/ns/net' % node.pid, os.O_RDONLY)
+            setns(ns)
+            try:
+                self.ipr = IPRoute()
+            finally:
+                setns(root)
+        finally:
+            os.close(root)
+            if ns is not None:
+                os.close(ns)
+        self.links = dict((link.get_attr('IFLA_IFNAME'), link['index'])
+                          for link in self.ipr.get_links())
+
+    def close(self):
+        self.ipr.close()
+
+    def addAddress(self, intf, ip):
+        # ip: a.b.c.d/x
+        adr, prefixLen = ip.split('/')
+        self.ipr.addr('replace', index=self.links[intf], address=adr,
+                      prefixlen=int(prefixLen))
+        self.ipr.link('set', index=self.links[intf], state='up')
+
+    def addRoute(self, spec):
+        dst, hops = parseRoute(spec)
+        kwargs = {}
+        if dst != 'default':
+            kwargs['dst'] = dst
+        if len(hops) == 1:
+            kwargs.update(gateway=hops[0][0], oif=self.links[hops[0][1]])
+        else:
+            kwargs['multipath'] = [{'gateway': gw, 'oif': self.links[intf], 'hops': 0}
+                                   for gw, intf in hops]
+        self.ipr.route('replace', **kwargs)
+
+def configure(nodes):
+    """Set addresses and routes over netlink, without running any command.
+       nodes: list of (node, [(intf, a.b.c.d/x)], [route]), where the routes
+              are 'ip route' specifications (see routing.route())
+       returns: nodes that could not be configured (to configure through
+                their shell instead)"""
+    failed = []
+    for node, addresses, routes in nodes:
+        try:
+            session = Session(node)
+        except (OSError, NetlinkError) as e:
+            info('*** No netlink socket for', node.name + ':', e, '\n')
+            failed.append((node, addresses, routes))
+            continue
+        try:
+            for intf, ip in addresses:
+                session.addAddress(intf, ip)
+            for spec in routes:
+                session.addRoute(spec)
+        except (KeyError, NetlinkError) as e:
+            info('*** Netlink configuration of', node.name, 'failed:', e, '\n')
+            failed.append((node, addresses, routes))
+        finally:
+            session.close()
+    return failed
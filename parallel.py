@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from channel import Channel
+import select
+
+def addNodes(net, nodes, workers):
+    """Create nodes concurrently and add them to net in the given order.
+       nodes: list of (name, cls, params, isSwitch), like net.addHost() and
+              net.addSwitch() (explicit params only: default IPs, MACs and
+              listen ports of Mininet are not assigned)
+       workers: number of nodes created at the same time"""
+    def create(node):
+        name, cls, params, isSwitch = node
+        if isSwitch:
+            params = dict(params, inNamespace=net.inNamespace)
+        return cls(name, **params)
+
+    pool = ThreadPoolExecutor(workers)
+    try:
+        created = list(pool.map(create, nodes))
+    finally:
+        pool.shutdown()
+    for (name, cls, params, isSwitch), node in zip(nodes, created):
+        (net.switches if isSwitch else net.hosts).append(node)
+        net.nameToNode[name] = node
+    return created
+
+def linkRounds(links):
+    """Split links in rounds of links that don't share any node (first fit
+       edge coloring: every link goes to the first round where both of its
+       nodes are still free).
+       links: list of (name1, name2)
+       returns: list of rounds (lists of indexes of links)"""
+    rounds = []
+    busy = {} # node -> set of rounds where it already has a link
+    for i, (name1, name2) in enumerate(links):
+        used1, used2 = busy.setdefault(name1, set()), busy.setdefault(name2, set())
+        r = 0
+        while r in used1 or r in used2:
+            r += 1
+        if r == len(rounds):
+            rounds.append([])
+        rounds[r].append(i)
+        used1.add(r)
+        used2.add(r)
+    return rounds
+
+def addLinks(net, links, workers):
+    """Create links concurrently and add them to net in the given order.
+       Creating a link runs commands in the shells of both nodes, so links
+       are created in rounds where every node is used by one link at most.
+       links: list of (name1, port1, name2, port2, params1, params2), with
+              every port given so that numbering doesn't depend on timing
+       workers: number of links created at the same time"""
+    # MACs are drawn here so that they only depend on the order of the links
+    options = [dict(port1=port1, port2=port2, params1=params1, params2=params2,
+                    addr1=net.randMac(), addr2=net.randMac())
+               for name1, port1, name2, port2, params1, params2 in links]
+    if net.intf is not None:
+        for o in options:
+            o['intf'] = net.intf
+
+    def create(i):
+        return net.link(net[links[i][0]], net[links[i][2]], **options[i])
+
+    created = [None] * len(links)
+    pool = ThreadPoolExecutor(workers)
+    try:
+        for batch in linkRounds([(l[0], l[2]) for l in links]):
+            for i, link in zip(batch, pool.map(create, batch)):
+                created[i] = link
+    finally:
+        pool.shutdown()
+    net.links.extend(created)
+    return created
+
+def fanOut(commands, timeoutms=None):
+    """Run shell commands on many nodes at once and gather their results.
+       The commands of every node are written to its shell in one go (see
+       channel.Channel) and the outputs of all the nodes are collected as
+       they come; the commands of a node run one after another, in order.
+       commands: list of (node, cmd)
+       timeoutms: give up if no node produces output for this long
+       returns: list of (node, output, status) in the order of commands,
+                where status is the exit status of the command (None for
+                commands sent to the background with '&')"""
+    channels = OrderedDict() # node -> Channel
+    indexes = OrderedDict()  # node -> [index of its commands]
+    for i, (node, cmd) in enumerate(commands):
+        if node not in channels:
+            channels[node] = Channel(node)
+            indexes[node] = []
+        channels[node].add(cmd)
+        indexes[node].append(i)
+    results = [None] * len(commands)
+    poller = select.poll()
+    fds = {}
+
+    def collect(node):
+        for i, (output, status) in zip(indexes[node], channels[node].results):
+            results[i] = (node, output, status)
+
+    for node, channel in channels.items():
+        channel.send()
+        fds[node.stdout.fileno()] = node
+        poller.register(node.stdout.fileno(), select.POLLIN)
+    while fds:
+        events = poller.poll(timeoutms)
+        if not events:
+            raise RuntimeError('No output from %s after %s ms' %
+                               (', '.join(n.name for n in fds.values()), timeoutms))
+        for fd, event in events:
+            node = fds[fd]
+            if channels[node].poll():
+                collect(node)
+                poller.unregister(fd)
+                del fds[fd]
+    return results
@@ -0,0 +1,294 @@
+from mininet.log import info
+from collections import OrderedDict
+from util import Network
+from cores import CORES
+from firewall import FIREWALLS
+from routing import route, multipathRoute, routeTables
+from hashlib import sha1
+import gzip
+import json
+import os
+import sys
+
+# On-disk cache of compiled plans, see cachedPlan()
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mininet-nat-plans')
+CACHE_SIZE = 64 * 2**20 # Bytes
+
+def intfName(node, port):
+    # Name Mininet gives to interface 'port' of 'node'
+    return '%s-eth%d' % (node, port)
+
+def address(ip):
+    # a.b.c.d of an a.b.c.d/x address
+    return ip.split('/')[0]
+
+class Plan(object):
+    """Everything NATNetwork builds, as plain data: nodes, links, addresses,
+       routes and firewall rules. Compiling a plan doesn't touch the kernel,
+       so it can be inspected, exported or tested without root."""
+    def __init__(self, params):
+        """params: dict of the parameters the plan was compiled with"""
+        self.params = params
+        self.ipBase = None
+        self.switches = []
+        self.nats = []      # (name, a.b.c.d/x, flush iptables), see compilePlan
+        self.routers = []   # Routers of the local subnets
+        self.transit = []   # Routers of the core without a local subnet
+        self.hosts = []     # (name, a.b.c.d/x)
+        self.links = []     # (node1, port1, a.b.c.d/x or None, node2, port2, a.b.c.d/x or None)
+        self.routes = OrderedDict() # node -> [route], see routing.route()
+        self.hashPolicy = None # ECMP hash policy of the core routers
+        self.firewall = None   # Backend of the NAT rules
+        self.uplinks = []   # (gateway, interface of the first gateway, a.b.c.d/x)
+        self.lans = []      # a.b.c.d/x of the local subnet of each router
+        self.forwards = []  # (inIntf, proto, port, a.b.c.d:port) DNAT rules
+        self.server = None  # Host that runs the Flask server
+
+    def rules(self):
+        # NAT gateway -> Firewall with its NAT rules
+        rules = OrderedDict()
+        for name, ip, flush in self.nats:
+            rules[name] = FIREWALLS[self.firewall]([intfName(name, 0)])
+            rules[name].addNAT(self.lans)
+        # The first gateway also takes the traffic of the uplinks of the others
+        first = rules[self.nats[0][0]]
+        for gateway, intf, subnet in self.uplinks:
+            first.addUplink(intf, subnet)
+        for forward in self.forwards:
+            first.addDNAT(*forward)
+        return rules
+
+    def addresses(self):
+        # node -> [(interface, a.b.c.d/x)]
+        addresses = OrderedDict()
+        for name, ip, flush in self.nats:
+            addresses.setdefault(name, []).append((intfName(name, 0), ip))
+        for name, ip in self.hosts:
+            addresses.setdefault(name, []).append((intfName(name, 0), ip))
+        for node1, port1, ip1, node2, port2, ip2 in self.links:
+            if ip1 is not None:
+                addresses.setdefault(node1, []).append((intfName(node1, port1), ip1))
+            if ip2 is not None:
+                addresses.setdefault(node2, []).append((intfName(node2, port2), ip2))
+        return addresses
+
+    def show(self):
+        for node, intfs in self.addresses().items():
+            info("  ", node + ":", ' '.join('%s %s' % intf for intf in intfs), "\n")
+        info("\n")
+
+    def asDict(self, rules=True):
+        # rules: include the lines of the NAT rules (not needed to rebuild the plan)
+        plan = OrderedDict(self.__dict__)
+        if rules:
+            plan['rules'] = OrderedDict((name, rules.lines())
+                                        for name, rules in self.rules().items())
+        return plan
+
+    @classmethod
+    def fromDict(cls, data):
+        plan = cls(data['params'])
+        for key, value in data.items():
+            if key != 'rules':
+                setattr(plan, key, value)
+        plan.routes = OrderedDict(plan.routes)
+        return plan
+
+    def export(self, filename='-'):
+        # Write the plan as JSON to filename ('-': standard output)
+        if filename == '-':
+            json.dump(self.asDict(), sys.stdout, indent=1)
+            sys.stdout.write('\n')
+        else:
+            with open(filename, 'w') as f:
+                json.dump(self.asDict(), f, separators=(',', ':'))
+
+def compilePlan(nrouters=2, nhosts=3, server=False, firewall='iptables', core='mesh',
+                ecmp=None, nnats=1):
+    """Plan of a NAT network (see NATNetwork in main.py for the parameters).
+       Returns None if the local subnets or the links of the core don't fit
+       in their address space."""
+    if isinstance(nhosts, int):
+        nhosts = [nhosts] * nrouters
+    plan = Plan(OrderedDict([('nrouters', nrouters), ('nhosts', list(nhosts)),
+                             ('server', server), ('firewall', firewall),
+                             ('core', core), ('ecmp', ecmp), ('nnats', nnats)]))
+
+    netN = Network('172.16.0.0/16')
+    netR = Network('10.10.0.0/16', nextSubnet='10.10.10.0')
+    netH = Network('192.168.0.0/16', nextSubnet='192.168.1.0')
+    netU = Network('10.254.0.0/16')
+    plan.ipBase = netN.ip
+    plan.switches = ['s%d' % i for i in range(nrouters + 1)]
+
+    # The first NAT gateway is in the root namespace: it flushes iptables
+    # (the nftables rules can't override the DROP policy of a flushed
+    # iptables), forwards the ports of the servers and masquerades the
+    # local subnets out of the host. Every other gateway has a namespace
+    # of its own, so it does the connection tracking and masquerading of
+    # the routers that use it, and reaches the outside through an uplink
+    # to the first one, which only has to masquerade the uplink address
+    # (so the root namespace still tracks each connection once).
+    # All of them loosen the reverse path filter (see
+    # routing.rpFilterCommand)
+    for i in range(1, nnats + 1):
+        name = 'nat' if i == 1 else 'nat%d' % i
+        plan.nats.append((name, netN.giveIP(name, intfName(name, 0)),
+                          firewall == 'iptables' and i == 1))
+        plan.links.append(('s0', None, None, name, 0, None))
+    natIPs = [address(ip) for name, ip, flush in plan.nats]
+    nat = plan.nats[0][0]
+    defaults = {} # Gateway -> default route through its uplink
+    for i, (name, ip, flush) in enumerate(plan.nats[1:], 1):
+        subnet = netU.addSubnet(minHosts=2)
+        ip1 = subnet.giveIP(name, intfName(name, 1))
+        ip2 = subnet.giveIP(nat, intfName(nat, i))
+        plan.links.append((name, 1, ip1, nat, i, ip2))
+        plan.uplinks.append((name, intfName(nat, i), subnet.ip))
+        defaults[name] = route('default', address(ip2), intfName(name, 1))
+
+    # Each local subnet holds its hosts plus the router
+    plan.routers = ['r%d' % i for i in range(1, nrouters + 1)]
+    lans = netH.addSubnets([n + 1 for n in nhosts], routers=plan.routers)
+    if lans is None:
+        info('*** The local subnets do not fit in', netH.ip, '\n')
+        return None
+    for i, r in enumerate(plan.routers, 1):
+        plan.links.append(('s0', None, None, r, 0, netN.giveIP(r, intfName(r, 0))))
+        plan.links.append(('s%d' % i, None, None, r, 1, lans[i-1].giveIP(r, intfName(r, 1))))
+
+    # Connect the routers between them with the selected core topology
+    graph = CORES[core](nrouters)
+    plan.transit = graph.transit
+    peers = dict((name, {}) for name in graph.nodes()) # node -> neighbor -> (neighbor IP, intf)
+    for name1, port1, name2, port2 in graph.links:
+        subnet = netR.addSubnet(minHosts=2)
+        if subnet is None:
+            info('*** The links of the core do not fit in', netR.ip, '\n')
+            return None
+        intf1, intf2 = intfName(name1, port1), intfName(name2, port2)
+        ip1, ip2 = subnet.giveIP(name1, intf1), subnet.giveIP(name2, intf2)
+        plan.links.append((name1, port1, ip1, name2, port2, ip2))
+        peers[name1][name2] = (address(ip2), intf1)
+        peers[name2][name1] = (address(ip1), intf2)
+
+    n = 0
+    for i, r in enumerate(plan.routers, 1):
+        for j in range(nhosts[i-1]):
+            n += 1
+            h = 'h%d' % n
+            plan.hosts.append((h, lans[i-1].giveIP(h, intfName(h, 0))))
+            plan.links.append((h, 0, None, 's%d' % i, None, None))
+
+    # Number the ports of the switches in link order, as Mininet would
+    ports = dict((s, 1) for s in plan.switches)
+    for i, (name1, port1, ip1, name2, port2, ip2) in enumerate(plan.links):
+        if port1 is None:
+            port1 = ports[name1]
+            ports[name1] += 1
+        if port2 is None:
+            port2 = ports[name2]
+            ports[name2] += 1
+        plan.links[i] = (name1, port1, ip1, name2, port2, ip2)
+
+    if server is True and plan.hosts:
+        plan.server, ip = plan.hosts[0]
+        plan.forwards.append(('enp0s3', 'tcp', 5200, '%s:5200' % address(ip)))
+    # The replies of the servers have to go back through the gateway that
+    # translated the requests, the first one
+    pinned = set(netH.locate(dest.split(':')[0]).router
+                 for inIntf, proto, port, dest in plan.forwards)
+
+    # Local subnets are reached through the router that owns them, and
+    # adjacent subnets with the same next hop share an aggregated route
+    lanRoutes = netH.aggregateRoutes(lambda s: s.router)
+    for name, ip, flush in plan.nats:
+        plan.routes[name] = [route(lan, address(netN.hostIP(r)), intfName(name, 0))
+                             for lan, r in lanRoutes]
+        if name in defaults:
+            plan.routes[name].append(defaults[name])
+    # Routers reach the other local subnets through the shortest path in the core
+    tables = routeTables(graph.neighbors, netH, multipath=ecmp is not None)
+    for name in graph.nodes():
+        routes = plan.routes[name] = []
+        if name in graph.routers:
+            if name in pinned:
+                gateways = natIPs[:1]
+            elif ecmp is not None:
+                gateways = natIPs
+            else:
+                gateways = [natIPs[graph.routers.index(name) % nnats]]
+            routes.append(multipathRoute('default', [(g, intfName(name, 0)) for g in gateways]))
+        for lan, hops in tables[name]:
+            routes.append(multipathRoute(lan, [peers[name][hop] for hop in hops]))
+    plan.hashPolicy = ecmp
+    for i, r in enumerate(plan.routers):
+        gateway = address(lans[i].hostIP(r))
+        for h in lans[i].hosts:
+            if h != r:
+                plan.routes[h] = [route('default', gateway, intfName(h, 0))]
+
+    plan.firewall = firewall
+    plan.lans = [lan.ip for lan in lans]
+    return plan
+
+def codeVersion():
+    # Hash of the source of the modules that compile plans
+    version = sha1()
+    for module in ('util', 'cores', 'routing', 'firewall', 'plan'):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               module + '.py'), 'rb') as f:
+            version.update(f.read())
+    return version.hexdigest()
+
+def cachedPlan(cacheDir=CACHE_DIR, maxSize=CACHE_SIZE, **params):
+    """Same as compilePlan(**params), but plans are kept in cacheDir as
+       gzipped JSON files keyed by a hash of the parameters and of the code
+       that compiles them. When the files of cacheDir add up to more than
+       maxSize bytes, the least recently used ones are deleted."""
+    if isinstance(params.get('nhosts'), int):
+        params['nhosts'] = [params['nhosts']] * params.get('nrouters', 2)
+    key = sha1(json.dumps([codeVersion(), params], sort_keys=True).encode()).hexdigest()
+    path = os.path.join(cacheDir, key + '.json.gz')
+    try:
+        with gzip.open(path, 'rt') as f:
+            plan = Plan.fromDict(json.load(f))
+        os.utime(path, None) # Mark it as recently used
+        return plan
+    except (IOError, OSError, EOFError, ValueError, KeyError, TypeError, AttributeError):
+        # A truncated or corrupted entry is a miss too, it gets compiled again
+        if os.path.exists(path):
+            info('*** Ignoring the corrupted cached plan', path, '\n')
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    plan = compilePlan(**params)
+    if plan is None:
+        return None
+    try:
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(plan.asDict(rules=False), f, separators=(',', ':'))
+        os.rename(tmp, path)
+        evictPlans(cacheDir, maxSize)
+    except (IOError, OSError) as e:
+        info('*** Could not cache the plan in', cacheDir + ':', e, '\n')
+    return plan
+
+def evictPlans(cacheDir=CACHE_DIR, maxSize=CACHE_SIZE):
+    # Delete the least recently used plans of cacheDir until they fit in maxSize bytes
+    plans = []
+    for name in os.listdir(cacheDir):
+        if name.endswith('.json.gz'):
+            st = os.stat(os.path.join(cacheDir, name))
+            plans.append((st.st_mtime, st.st_size, name))
+    total = sum(size for mtime, size, name in plans)
+    for mtime, size, name in sorted(plans):
+        if total <= maxSize:
+            break
+        os.remove(os.path.join(cacheDir, name))
+        total -= size
@@ -0,0 +1,89 @@
+from util import batchFile
+from collections import OrderedDict, deque
+
+# Next hop tables of the last graph shapes, see nextHopTable()
+_tables = OrderedDict()
+_maxTables = 32
+
+def route(dest, gateway, intf):
+    # 'ip route' specification of the route to dest via gateway (through intf)
+    return '%s via %s dev %s' % (dest, gateway, intf)
+
+def multipathRoute(dest, nexthops):
+    """'ip route' specification of an ECMP route to dest
+       nexthops: list of (gateway, intf), a single one gives a plain route"""
+    if len(nexthops) == 1:
+        return route(dest, *nexthops[0])
+    return dest + ''.join(' nexthop via %s dev %s weight 1' % hop for hop in nexthops)
+
+# Values of net.ipv4.fib_multipath_hash_policy
+HASH_POLICIES = {'l3': 0, 'l4': 1, 'l3-inner': 2}
+
+def hashPolicyCommand(policy):
+    # Command that selects the fields hashed to choose the path of ECMP routes
+    return 'sysctl -qw net.ipv4.fib_multipath_hash_policy=%d' % HASH_POLICIES[policy]
+
+def rpFilterCommand(intfs):
+    """Command that sets the reverse path filter of interfaces to loose
+       mode: a packet is accepted if its source is reachable through any
+       interface, not just the one it came in on. The routes of the routers
+       and the return routes of the NAT gateways are computed separately,
+       so a strict filter (the default of some distributions) would drop
+       whatever doesn't come back the way it left."""
+    return 'sysctl -qw ' + ' '.join('net.ipv4.conf.%s.rp_filter=2' % intf for intf in intfs)
+
+def routeCommand(routes):
+    """Command that installs (or replaces) routes in one go, and the batch
+       file it reads (None if it doesn't need one), to delete once it's done.
+       routes: list of 'ip route' specifications (see route())"""
+    if len(routes) == 1:
+        return 'ip route replace ' + routes[0], None
+    name = batchFile(['route replace ' + r for r in routes])
+    return 'ip -force -batch ' + name, name
+
+def nextHops(neighbors, src, multipath=False):
+    """Breadth first search from src.
+       returns: {destination: (neighbors of src in a shortest path towards it)}
+       Without multipath only the first neighbor found is returned."""
+    hops = {}
+    dist = {src: 0}
+    queue = deque([src])
+    while queue:
+        node = queue.popleft()
+        for n in neighbors[node]:
+            if n not in dist:
+                dist[n] = dist[node] + 1
+                hops[n] = (n,) if node == src else hops[node]
+                queue.append(n)
+            elif multipath and dist[n] == dist[node] + 1:
+                # Another shortest path, through the hops of node
+                hops[n] += tuple(h for h in hops[node] if h not in hops[n])
+    return hops
+
+def nextHopTable(neighbors, multipath=False):
+    """All pairs shortest paths of a graph with links of equal cost.
+       neighbors: {node: [neighbor]}
+       multipath: keep every next hop of equal cost paths (ECMP)
+       returns: {node: {destination: (next hop,)}}
+       Tables are cached by graph shape, so building the same topology
+       again doesn't recompute them."""
+    shape = (multipath,) + tuple((node, tuple(n)) for node, n in neighbors.items())
+    table = _tables.pop(shape, None)
+    if table is None:
+        table = dict((node, nextHops(neighbors, node, multipath)) for node in neighbors)
+    _tables[shape] = table
+    while len(_tables) > _maxTables:
+        _tables.popitem(last=False)
+    return table
+
+def routeTables(neighbors, network, multipath=False):
+    """Next hop routes of every node of a graph to the subnets of network.
+       neighbors: {node: [neighbor]}
+       network: Network whose subnets are owned by nodes of the graph
+                (their router attribute)
+       multipath: route through every equal cost next hop (ECMP)
+       returns: {node: [(a.b.c.d/x, (next hop,))]}, only with the routes
+                to the subnets of other nodes, aggregated per next hops"""
+    table = nextHopTable(neighbors, multipath)
+    return dict((node, network.aggregateRoutes(lambda s: hops.get(s.router)))
+                for node, hops in table.items())
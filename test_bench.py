@@ -0,0 +1,35 @@
+# Tests of the comparison of benchmark results
+
+import pytest
+
+pytest.importorskip('mininet')
+
+from bench import compare, isolated, KEY
+from fakenet import FakeNet
+
+def result(**values):
+    fields = dict(nrouters=2, nhosts=1, core='mesh', workers=None, useNetlink=False,
+                  backend='mininet', bringup=1.0, teardown=1.0, memory=1000, maxrss=30000,
+                  commands=10)
+    fields.update(values)
+    return fields
+
+@pytest.mark.parametrize('new,regressed', [
+    (result(), []),
+    (result(bringup=1.1), []),
+    (result(bringup=1.5, memory=2000), ['bringup', 'memory']),
+    (result(error='failed'), ['error']),
+    # Only results measured the same way are compared
+    (result(bringup=5.0, backend='simulated'), []),
+    (result(bringup=5.0, workers=8), []),
+    (result(bringup=5.0, useNetlink=True), []),
+])
+def test_compare(new, regressed):
+    regressions = compare([new], [result()], 1.2)
+    assert [metric for r, metric, value, old in regressions] == regressed
+
+def test_isolated():
+    run = isolated(2, 1, 'mesh', netClass=FakeNet)
+    assert 'error' not in run
+    assert [run[field] for field in KEY] == [2, 1, 'mesh', None, False, 'simulated']
+    assert run['maxrss'] > 0 and run['memory'] >= 0 and run['rules'] == 11
@@ -0,0 +1,199 @@
+# Tests of the NAT rules generated by the firewall backends
+
+import pytest
+
+pytest.importorskip('mininet')
+
+from firewall import Ruleset, IptablesFirewall, NftFirewall, FIREWALLS
+
+LANS = ['192.168.1.0/24', '192.168.2.0/25']
+DNAT = ('enp0s3', 'tcp', 5200, '192.168.1.2:5200')
+
+def firewall(cls, intfs, forwards):
+    rules = cls(intfs)
+    rules.addNAT(LANS)
+    for forward in forwards:
+        rules.addDNAT(*forward)
+    return rules
+
+class Node(object):
+    # Records the commands it is given
+    name = 'nat'
+
+    def __init__(self):
+        self.cmds = []
+
+    def cmd(self, *args):
+        self.cmds.append(' '.join(args))
+        return ''
+
+def test_ruleset_payload():
+    ruleset = Ruleset()
+    ruleset.add('nat', 'POSTROUTING', '-s 10.0.0.0/8 -j MASQUERADE')
+    ruleset.addChain('filter', 'MY-CHAIN')
+    ruleset.add('filter', 'FORWARD', '-j MY-CHAIN', insert=True)
+    ruleset.add('filter', 'MY-CHAIN', '-i eth0 -j ACCEPT')
+    assert ruleset.payload() == [
+        '*nat',
+        '-A POSTROUTING -s 10.0.0.0/8 -j MASQUERADE',
+        'COMMIT',
+        '*filter',
+        ':MY-CHAIN - [0:0]',
+        '-I FORWARD -j MY-CHAIN',
+        '-A MY-CHAIN -i eth0 -j ACCEPT',
+        'COMMIT']
+    assert len(ruleset) == 3
+    assert Ruleset().payload() == []
+
+IPTABLES_FILTER = {
+    1: ['-A MN-FORWARD -i nat-eth0 -d 192.168.1.0/24 -j DROP',
+        '-A MN-FORWARD -i nat-eth0 -d 192.168.2.0/25 -j DROP',
+        '-A MN-FORWARD -i nat-eth0 -s 192.168.1.0/24 -j ACCEPT',
+        '-A MN-FORWARD -o nat-eth0 -d 192.168.1.0/24 -j ACCEPT',
+        '-A MN-FORWARD -i nat-eth0 -s 192.168.2.0/25 -j ACCEPT',
+        '-A MN-FORWARD -o nat-eth0 -d 192.168.2.0/25 -j ACCEPT'],
+    2: ['-A MN-FORWARD -i nat-eth0 -d 192.168.1.0/24 -j DROP',
+        '-A MN-FORWARD -i nat-eth0 -d 192.168.2.0/25 -j DROP',
+        '-A MN-FORWARD -i nat2-eth0 -d 192.168.1.0/24 -j DROP',
+        '-A MN-FORWARD -i nat2-eth0 -d 192.168.2.0/25 -j DROP',
+        '-A MN-FORWARD -i nat-eth0 -s 192.168.1.0/24 -j ACCEPT',
+        '-A MN-FORWARD -o nat-eth0 -d 192.168.1.0/24 -j ACCEPT',
+        '-A MN-FORWARD -i nat2-eth0 -s 192.168.1.0/24 -j ACCEPT',
+        '-A MN-FORWARD -o nat2-eth0 -d 192.168.1.0/24 -j ACCEPT',
+        '-A MN-FORWARD -i nat-eth0 -s 192.168.2.0/25 -j ACCEPT',
+        '-A MN-FORWARD -o nat-eth0 -d 192.168.2.0/25 -j ACCEPT',
+        '-A MN-FORWARD -i nat2-eth0 -s 192.168.2.0/25 -j ACCEPT',
+        '-A MN-FORWARD -o nat2-eth0 -d 192.168.2.0/25 -j ACCEPT'],
+}
+
+@pytest.mark.parametrize('intfs', [['nat-eth0'], ['nat-eth0', 'nat2-eth0']])
+@pytest.mark.parametrize('forwards', [[], [DNAT]])
+def test_iptables_payload(intfs, forwards):
+    rules = firewall(IptablesFirewall, intfs, forwards)
+    expected = (['*filter',
+                 ':MN-FORWARD - [0:0]',
+                 '-I FORWARD -j MN-FORWARD'] +
+                IPTABLES_FILTER[len(intfs)] +
+                ['COMMIT',
+                 '*nat',
+                 ':MN-POSTROUTING - [0:0]',
+                 ':MN-PREROUTING - [0:0]',
+                 '-I POSTROUTING -j MN-POSTROUTING',
+                 '-I PREROUTING -j MN-PREROUTING',
+                 '-A MN-POSTROUTING -s 192.168.1.0/24 ! -d 192.168.1.0/24 -j MASQUERADE',
+                 '-A MN-POSTROUTING -s 192.168.2.0/25 ! -d 192.168.2.0/25 -j MASQUERADE'] +
+                ['-A MN-PREROUTING -i enp0s3 -p tcp --dport 5200 -j DNAT --to 192.168.1.2:5200'
+                 for forward in forwards] +
+                ['COMMIT'])
+    assert rules.lines() == expected
+
+@pytest.mark.parametrize('intfs,match', [
+    (['nat-eth0'], '"nat-eth0"'),
+    (['nat-eth0', 'nat2-eth0'], '{ "nat-eth0", "nat2-eth0" }'),
+])
+@pytest.mark.parametrize('forwards', [[], [DNAT]])
+def test_nft_lines(intfs, match, forwards):
+    rules = firewall(NftFirewall, intfs, forwards)
+    expected = (['table ip mininet_nat',
+                 'delete table ip mininet_nat',
+                 'table ip mininet_nat {',
+                 '    set lans {',
+                 '        type ipv4_addr',
+                 '        flags interval',
+                 '        elements = { 192.168.1.0/24, 192.168.2.0/25 }',
+                 '    }',
+                 '    chain forward {',
+                 '        type filter hook forward priority 0; policy accept;',
+                 '        iifname %s ip daddr @lans drop' % match,
+                 '        iifname %s ip saddr @lans accept' % match,
+                 '        oifname %s ip daddr @lans accept' % match,
+                 '    }',
+                 '    chain postrouting {',
+                 '        type nat hook postrouting priority 100; policy accept;',
+                 '        ip saddr @lans ip daddr != @lans masquerade',
+                 '    }',
+                 '    chain prerouting {',
+                 '        type nat hook prerouting priority -100; policy accept;'] +
+                ['        iifname "enp0s3" tcp dport 5200 dnat to 192.168.1.2:5200'
+                 for forward in forwards] +
+                ['    }',
+                 '}'])
+    assert rules.lines() == expected
+
+def test_nft_no_subnets():
+    # An empty set has no elements line
+    lines = NftFirewall(['nat-eth0']).lines()
+    assert not any('elements' in line for line in lines)
+    assert lines[3:7] == ['    set lans {', '        type ipv4_addr',
+                          '        flags interval', '    }']
+
+def test_iptables_purge_command():
+    assert IptablesFirewall.purgeCommand() == '; '.join([
+        'while iptables -t filter -D FORWARD -j MN-FORWARD 2>/dev/null; do :; done',
+        'iptables -t filter -F MN-FORWARD 2>/dev/null',
+        'iptables -t filter -X MN-FORWARD 2>/dev/null',
+        'while iptables -t nat -D POSTROUTING -j MN-POSTROUTING 2>/dev/null; do :; done',
+        'iptables -t nat -F MN-POSTROUTING 2>/dev/null',
+        'iptables -t nat -X MN-POSTROUTING 2>/dev/null',
+        'while iptables -t nat -D PREROUTING -j MN-PREROUTING 2>/dev/null; do :; done',
+        'iptables -t nat -F MN-PREROUTING 2>/dev/null',
+        'iptables -t nat -X MN-PREROUTING 2>/dev/null'])
+
+def test_nft_purge_command():
+    assert NftFirewall.purgeCommand() == 'nft delete table ip mininet_nat 2>/dev/null'
+
+def test_iptables_rules_in_dedicated_chains():
+    # Only the jumps touch the built-in chains, the purge removes everything else
+    chains = [chain for table, hook, chain in IptablesFirewall.chains]
+    for line in firewall(IptablesFirewall, ['nat-eth0'], [DNAT]).lines():
+        if line.startswith('-I '):
+            assert line.split()[2:] in [['-j', chain] for chain in chains]
+        elif line.startswith('-A '):
+            assert line.split()[1] in chains
+
+@pytest.mark.parametrize('backend', sorted(FIREWALLS))
+def test_remove_purges(backend):
+    node = Node()
+    firewall(FIREWALLS[backend], ['nat-eth0'], [DNAT]).remove(node)
+    assert node.cmds == [FIREWALLS[backend].purgeCommand()]
+
+UPLINKS = [('nat-eth1', '10.254.0.0/30'), ('nat-eth2', '10.254.0.4/30')]
+
+def test_iptables_uplinks():
+    rules = firewall(IptablesFirewall, ['nat-eth0'], [])
+    for uplink in UPLINKS:
+        rules.addUplink(*uplink)
+    lines = rules.lines()
+    assert lines[lines.index('COMMIT') - 4:lines.index('COMMIT')] == [
+        '-A MN-FORWARD -i nat-eth1 -s 10.254.0.0/30 -j ACCEPT',
+        '-A MN-FORWARD -o nat-eth1 -d 10.254.0.0/30 -j ACCEPT',
+        '-A MN-FORWARD -i nat-eth2 -s 10.254.0.4/30 -j ACCEPT',
+        '-A MN-FORWARD -o nat-eth2 -d 10.254.0.4/30 -j ACCEPT']
+    assert lines[-3:-1] == ['-A MN-POSTROUTING -s 10.254.0.0/30 -j MASQUERADE',
+                            '-A MN-POSTROUTING -s 10.254.0.4/30 -j MASQUERADE']
+
+def test_nft_uplinks():
+    rules = firewall(NftFirewall, ['nat-eth0'], [])
+    for uplink in UPLINKS:
+        rules.addUplink(*uplink)
+    chains = rules.chains()
+    assert chains['forward'][1][3:] == [
+        'iifname "nat-eth1" ip saddr 10.254.0.0/30 accept',
+        'oifname "nat-eth1" ip daddr 10.254.0.0/30 accept',
+        'iifname "nat-eth2" ip saddr 10.254.0.4/30 accept',
+        'oifname "nat-eth2" ip daddr 10.254.0.4/30 accept']
+    assert chains['postrouting'][1][1:] == ['ip saddr 10.254.0.0/30 masquerade',
+                                            'ip saddr 10.254.0.4/30 masquerade']
+    assert len(rules) == 4 + 6
+
+# (backend, interfaces, forwards, number of rules)
+COUNTS = [
+    ('iptables', ['nat-eth0'], [], 3 + 6 + 2),
+    ('iptables', ['nat-eth0', 'nat2-eth0'], [DNAT], 3 + 12 + 2 + 1),
+    ('nftables', ['nat-eth0'], [], 4),
+    ('nftables', ['nat-eth0', 'nat2-eth0'], [DNAT], 5),
+]
+
+@pytest.mark.parametrize('backend,intfs,forwards,count', COUNTS)
+def test_len(backend, intfs, forwards, count):
+    assert len(firewall(FIREWALLS[backend], intfs, forwards)) == count
@@ -0,0 +1,222 @@
+# Tests of the build logic on the simulated network of fakenet (no root needed)
+
+import pytest
+import gzip
+import json
+import os
+
+pytest.importorskip('mininet')
+
+from mininet.util import ipParse
+from util import SubnetAllocator, PrefixTrie, Network, aggregate
+from routing import nextHops
+from cores import CORES
+from plan import compilePlan, cachedPlan
+from fakenet import FakeNet
+from main import startNetwork, stopNetwork
+from verify import verifyNetwork, probes
+
+def build(**params):
+    plan = compilePlan(**params)
+    net, rules = startNetwork(plan, netClass=FakeNet)
+    return plan, net, rules
+
+@pytest.mark.parametrize('core', sorted(CORES))
+@pytest.mark.parametrize('ecmp,nnats', [(None, 1), ('l4', 2)])
+def test_hosts_reach_each_other(core, ecmp, nnats):
+    plan, net, rules = build(nrouters=5, nhosts=[2, 1, 0, 3, 1], core=core,
+                             ecmp=ecmp, nnats=nnats)
+    hosts = [net.get(name) for name, ip in plan.hosts]
+    matrix = net.matrix(hosts)
+    assert all(all(row.values()) for row in matrix.values()), matrix
+    for host in hosts:
+        assert net.path(host, '8.8.8.8')[-1] == 'internet'
+    stopNetwork(net, plan, rules)
+
+def test_nat_gateways():
+    # Gateways past the first one reach the outside through their uplink to it
+    plan, net, rules = build(nrouters=3, nhosts=1, nnats=3, server=True)
+    assert [net.path(h, '8.8.8.8') for h in ('h1', 'h2', 'h3')] == [
+        ['h1', 'r1', 'nat', 'internet'],
+        ['h2', 'r2', 'nat2', 'nat', 'internet'],
+        ['h3', 'r3', 'nat3', 'nat', 'internet']]
+    assert list(rules) == ['nat', 'nat2', 'nat3']
+    assert rules['nat'].uplinks == [('nat-eth1', '10.254.0.0/30'), ('nat-eth2', '10.254.0.4/30')]
+    assert rules['nat'].forwards and not rules['nat2'].forwards and not rules['nat2'].uplinks
+    stopNetwork(net, plan, rules)
+
+def test_server_router_is_pinned():
+    # The replies of the server go back through the gateway that does the DNAT
+    plan = compilePlan(nrouters=2, nhosts=1, nnats=2, ecmp='l3', server=True)
+    assert plan.routes['r1'][0] == 'default via 172.16.0.1 dev r1-eth0'
+    assert plan.routes['r2'][0].count('nexthop') == 2
+
+def test_missing_routes_are_detected():
+    plan, net, rules = build(nrouters=3, nhosts=1, core='ring')
+    net.get('r2').routes.clear()
+    net.get('r2').trie = None
+    matrix = net.matrix([net.get('h1'), net.get('h2'), net.get('h3')])
+    assert matrix['h1']['h3']
+    assert not matrix['h1']['h2'] and not matrix['h2']['h1']
+    ok, cells = verifyNetwork(net, plan, seed=0)
+    assert not ok and not cells[('r1', 'r2')]
+    stopNetwork(net, plan, rules)
+
+def test_verify_passes():
+    plan, net, rules = build(nrouters=4, nhosts=2, core='mesh', server=True)
+    ok, cells = verifyNetwork(net, plan, seed=0, wait=0)
+    assert ok and all(cells.values())
+    assert cells[('enp0s3', 'h1')] and cells[('nat', 'h1')]
+    stopNetwork(net, plan, rules)
+
+@pytest.mark.parametrize('firewall,check', [
+    ('iptables', 'iptables -t nat -C MN-PREROUTING -i enp0s3 -p tcp --dport 5200 '
+                 '-j DNAT --to-destination 192.168.1.2:5200'),
+    ('nftables', "nft list chain ip mininet_nat prerouting | grep -qF "
+                 "'iifname \"enp0s3\" tcp dport 5200 dnat to 192.168.1.2:5200'"),
+])
+def test_dnat_probes(firewall, check):
+    plan = compilePlan(nrouters=2, nhosts=1, server=True, firewall=firewall)
+    strata = probes(plan, seed=0)
+    assert list(strata) == ['lan', 'egress', 'dnat', 'server']
+    assert strata['dnat'] == [('nat', ('enp0s3', 'h1'), '192.168.1.2:5200', check)]
+    assert [cell for src, cell, dst, cmd in strata['server']] == [('nat', 'h1')]
+
+def test_plan_does_not_fit():
+    assert compilePlan(nrouters=2, nhosts=[70000, 1]) is None
+
+def cacheFiles(cacheDir):
+    return sorted(name for name in os.listdir(str(cacheDir)) if name.endswith('.json.gz'))
+
+def test_cache_hit_and_miss(tmp_path):
+    plan = cachedPlan(cacheDir=str(tmp_path), nrouters=2, nhosts=1)
+    files = cacheFiles(tmp_path)
+    assert len(files) == 1
+    cached = cachedPlan(cacheDir=str(tmp_path), nrouters=2, nhosts=[1, 1])
+    assert json.loads(json.dumps(cached.asDict())) == json.loads(json.dumps(plan.asDict()))
+    assert cacheFiles(tmp_path) == files
+    cachedPlan(cacheDir=str(tmp_path), nrouters=3, nhosts=1)
+    assert len(cacheFiles(tmp_path)) == 2
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: data[:len(data) // 2], # Truncated gzip stream
+    lambda data: b'not gzip',
+    lambda data: gzip.compress(b'{"routes": []}'), # Missing keys
+    lambda data: gzip.compress(b'[1, 2]'),
+])
+def test_cache_corrupted(tmp_path, corrupt):
+    plan = cachedPlan(cacheDir=str(tmp_path), nrouters=2, nhosts=1)
+    path = os.path.join(str(tmp_path), cacheFiles(tmp_path)[0])
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(corrupt(data))
+    again = cachedPlan(cacheDir=str(tmp_path), nrouters=2, nhosts=1)
+    assert again.asDict() == plan.asDict()
+    # The bad entry was replaced by a good one
+    with gzip.open(path, 'rt') as f:
+        assert json.load(f)['params'] == plan.params
+
+def test_cache_eviction(tmp_path):
+    cachedPlan(cacheDir=str(tmp_path), nrouters=2, nhosts=1)
+    first = cacheFiles(tmp_path)[0]
+    size = os.path.getsize(os.path.join(str(tmp_path), first))
+    os.utime(os.path.join(str(tmp_path), first), (0, 0)) # Least recently used
+    cachedPlan(cacheDir=str(tmp_path), maxSize=size * 3 // 2, nrouters=2, nhosts=2)
+    files = cacheFiles(tmp_path)
+    assert len(files) == 1 and first not in files
+
+# (allocations as prefix lengths, expected bases relative to the network)
+ALLOCATIONS = [
+    ([24], [0]),
+    ([26, 25, 26], [0, 128, 64]),
+    ([30, 30, 29, 28], [0, 4, 8, 16]),
+    ([23], [None]),
+]
+
+@pytest.mark.parametrize('prefixLens,bases', ALLOCATIONS)
+def test_allocator(prefixLens, bases):
+    base = ipParse('10.0.0.0')
+    allocator = SubnetAllocator(base, 24)
+    got = [allocator.alloc(p) for p in prefixLens]
+    assert [None if adr is None else adr - base for adr in got] == bases
+    for adr in got:
+        if adr is not None:
+            allocator.release(adr)
+    stats = allocator.stats()
+    assert stats['used'] == 0 and stats['freeBlocks'] == 1
+
+def test_allocator_start():
+    base = ipParse('10.0.0.0')
+    allocator = SubnetAllocator(base, 24, start=base + 16)
+    assert allocator.alloc(28) - base == 16
+    assert allocator.alloc(25) - base == 128
+
+# (prefixes in the trie, address, expected value)
+LOOKUPS = [
+    (['10.0.0.0/8'], '10.1.2.3', '10.0.0.0/8'),
+    (['10.0.0.0/8', '10.1.0.0/16'], '10.1.2.3', '10.1.0.0/16'),
+    (['10.0.0.0/8', '10.1.0.0/16'], '10.2.0.1', '10.0.0.0/8'),
+    (['0.0.0.0/0', '192.168.1.0/24'], '8.8.8.8', '0.0.0.0/0'),
+    (['192.168.1.0/24'], '192.168.2.1', None),
+    (['192.168.1.7/32'], '192.168.1.7', '192.168.1.7/32'),
+]
+
+@pytest.mark.parametrize('prefixes,adr,expected', LOOKUPS)
+def test_trie_lookup(prefixes, adr, expected):
+    trie = PrefixTrie()
+    for prefix in prefixes:
+        ip, prefixLen = prefix.split('/')
+        trie.insert(ipParse(ip), int(prefixLen), prefix)
+    assert len(trie) == len(prefixes)
+    assert trie.lookup(ipParse(adr)) == expected
+
+def test_trie_remove():
+    trie = PrefixTrie()
+    trie.insert(ipParse('10.0.0.0'), 8, 'a')
+    trie.insert(ipParse('10.1.0.0'), 16, 'b')
+    assert trie.remove(ipParse('10.1.0.0'), 16) == 'b'
+    assert trie.lookup(ipParse('10.1.0.1')) == 'a'
+    assert trie.remove(ipParse('10.1.0.0'), 16) is None
+    assert len(trie) == 1
+
+# (routes as (a.b.c.d/x, nexthop), expected aggregated routes)
+AGGREGATES = [
+    ([('10.0.0.0/25', 'a'), ('10.0.0.128/25', 'a')], [('10.0.0.0/24', 'a')]),
+    ([('10.0.0.0/25', 'a'), ('10.0.0.128/25', 'b')],
+     [('10.0.0.0/25', 'a'), ('10.0.0.128/25', 'b')]),
+    ([('10.0.0.0/26', 'a'), ('10.0.0.64/26', 'a'), ('10.0.0.128/25', 'a')],
+     [('10.0.0.0/24', 'a')]),
+    # Not aligned on a common prefix
+    ([('10.0.0.64/26', 'a'), ('10.0.0.128/26', 'a')],
+     [('10.0.0.64/26', 'a'), ('10.0.0.128/26', 'a')]),
+    ([('10.0.0.0/25', 'a'), ('10.0.0.128/25', None)], [('10.0.0.0/25', 'a')]),
+]
+
+@pytest.mark.parametrize('routes,expected', AGGREGATES)
+def test_aggregate(routes, expected):
+    def parse(prefix):
+        ip, prefixLen = prefix.split('/')
+        return ipParse(ip), int(prefixLen)
+    got = aggregate([parse(prefix) + (hop,) for prefix, hop in routes])
+    assert got == [parse(prefix) + (hop,) for prefix, hop in expected]
+
+def test_add_subnets():
+    net = Network('192.168.0.0/16')
+    net.addSubnet(10)
+    net.addSubnet(100)
+    assert net.addSubnets([]) == []
+    assert len(net.subnets) == len(net.trie) == 2
+    subnets = net.addSubnets([3, 50])
+    assert [s.ip for s in net.subnets[2:]] == [s.ip for s in subnets]
+    assert [s.maxHosts >= n for s, n in zip(subnets, [3, 50])] == [True, True]
+
+# Square a-b-d, a-c-d: two shortest paths from a to d
+SQUARE = {'a': ['b', 'c'], 'b': ['a', 'd'], 'c': ['a', 'd'], 'd': ['b', 'c']}
+
+@pytest.mark.parametrize('multipath,expected', [
+    (False, {'b': ('b',), 'c': ('c',), 'd': ('b',)}),
+    (True, {'b': ('b',), 'c': ('c',), 'd': ('b', 'c')}),
+])
+def test_next_hops(multipath, expected):
+    assert nextHops(SQUARE, 'a', multipath) == expected
@@ -0,0 +1,95 @@
+# Tests of the address bookkeeping of util.Network
+
+import pytest
+
+pytest.importorskip('mininet')
+
+from mininet.util import ipParse
+from util import AddressPool, HostRegistry, Network
+
+BASE = ipParse('10.0.0.1')
+
+# (operations, expected results): 't' takes an address, an int releases BASE + int
+POOL = [
+    (['t', 't', 't'], [0, 1, 2]),
+    (['t', 't', 't', 't'], [0, 1, 2, None]),
+    (['t', 't', 0, 't'], [0, 1, None, 0]),
+    (['t', 't', 't', 1, 0, 't', 't', 't'], [0, 1, 2, None, None, 0, 1, None]),
+]
+
+@pytest.mark.parametrize('ops,expected', POOL)
+def test_pool(ops, expected):
+    pool = AddressPool(BASE, 3)
+    got = []
+    for op in ops:
+        if op == 't':
+            adr = pool.take()
+            got.append(None if adr is None else adr - BASE)
+        else:
+            got.append(pool.release(BASE + op))
+    assert got == expected
+    taken = sum(1 for op, adr in zip(ops, got) if op == 't' and adr is not None)
+    assert pool.available() == 3 - taken + sum(1 for op in ops if op != 't')
+
+@pytest.mark.parametrize('adr', [BASE - 1, BASE + 1, BASE + 3])
+def test_pool_release_foreign(adr):
+    pool = AddressPool(BASE, 3)
+    pool.take()
+    with pytest.raises(ValueError):
+        pool.release(adr)
+
+def test_pool_exhaust():
+    pool = AddressPool(BASE, 3)
+    adr = pool.take()
+    pool.release(adr)
+    pool.exhaust()
+    assert pool.available() == 0 and pool.take() is None
+
+def test_network_release_ip():
+    net = Network('10.0.0.0/30')
+    assert net.giveIP('a') == '10.0.0.1/30'
+    assert net.giveIP('b') == '10.0.0.2/30'
+    assert net.giveIP('c') is None
+    assert net.releaseIP('a') and not net.releaseIP('a')
+    assert net.giveIP('c') == '10.0.0.1/30'
+
+def test_registry():
+    hosts = HostRegistry(BASE)
+    hosts.add('h1', BASE + 5, 'h1-eth0')
+    hosts.add('h2', BASE)
+    assert list(hosts) == ['h1', 'h2'] and len(hosts) == 2
+    assert hosts['h1'] == BASE + 5 and hosts.intf('h1') == 'h1-eth0'
+    assert hosts.intf('h2') is None and 'h2' in hosts and 'h3' not in hosts
+    assert hosts.name(BASE + 5) == 'h1' and hosts.name(BASE) == 'h2'
+    for adr in (BASE - 1, BASE + 1, BASE + 6, BASE + 1000):
+        assert hosts.name(adr) is None
+
+def test_registry_pop():
+    hosts = HostRegistry(BASE)
+    hosts.add('h1', BASE)
+    hosts.add('h2', BASE + 1)
+    assert hosts.pop('h1') == BASE
+    assert hosts.pop('h1', 'missing') == 'missing'
+    assert hosts.name(BASE) is None and len(hosts) == 1
+    # The freed slot and address are reused
+    hosts.add('h3', BASE, 'h3-eth0')
+    assert hosts.names == ['h3', 'h2'] and len(hosts.addrs) == 2
+    assert list(hosts.items()) == [('h3', BASE), ('h2', BASE + 1)]
+    assert hosts.name(BASE) == 'h3' and hosts.intf('h3') == 'h3-eth0'
+
+@pytest.mark.parametrize('name,adr', [('h1', BASE + 2), ('h2', BASE), ('h2', BASE - 1)])
+def test_registry_conflicts(name, adr):
+    hosts = HostRegistry(BASE)
+    hosts.add('h1', BASE)
+    with pytest.raises(ValueError):
+        hosts.add(name, adr)
+    assert list(hosts.items()) == [('h1', BASE)]
+
+def test_network_host_name():
+    net = Network('10.0.0.0/24')
+    net.giveIP('a', 'a-eth0')
+    subnet = net.addSubnet(2, router='r1')
+    subnet.giveIP('b', 'b-eth1')
+    assert net.hostName('10.0.0.1') == 'b'
+    assert net.locate('10.0.0.1') == (subnet, 'r1', 'b', 'b-eth1')
+    assert net.hostName('10.0.0.2') is None and net.locate('10.1.0.1') is None
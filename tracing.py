@@ -0,0 +1,109 @@
+from mininet.node import Node
+from mininet.log import info
+from channel import Channel
+from collections import OrderedDict
+from time import time
+import json
+import os
+
+# Upper bounds (ms) of the buckets of the latency histograms, the last one is unbounded
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# Programs whose first argument tells what the command does
+SUBCOMMANDS = ('ip', 'nft', 'ovs-vsctl', 'ovs-ofctl', 'tc', 'ethtool')
+
+def commandKind(cmd):
+    """Program of a shell command, with the subcommand of the programs in
+       SUBCOMMANDS: 'ip route', 'ip -batch', 'iptables-restore'..."""
+    words = cmd.split()
+    if not words:
+        return ''
+    program = os.path.basename(words[0])
+    if program in SUBCOMMANDS:
+        if '-batch' in words:
+            return program + ' -batch'
+        for word in words[1:]:
+            if not word.startswith('-'):
+                return program + ' ' + word
+    return program
+
+class Tracer(object):
+    """Record of the commands run in the shell of the nodes.
+       While started, every node.cmd() and every command of a Channel is
+       recorded with its node, wall time and output size."""
+    def __init__(self):
+        self.events = [] # (node, cmd, start time, seconds, output bytes)
+        self.saved = None
+
+    def start(self):
+        tracer = self
+        cmd, split = Node.cmd, Channel.split
+        def tracedCmd(node, *args, **kwargs):
+            start = time()
+            output = cmd(node, *args, **kwargs)
+            tracer.record(node, ' '.join(str(arg) for arg in args), start, output)
+            return output
+        def tracedSplit(channel):
+            cmds = channel.cmds
+            split(channel)
+            starts = [channel.sent] + channel.ends[:-1]
+            for command, start, end, (output, status) in zip(cmds, starts, channel.ends,
+                                                             channel.results):
+                tracer.record(channel.node, command, start, output, end)
+        self.saved = cmd, split
+        Node.cmd, Channel.split = tracedCmd, tracedSplit
+
+    def stop(self):
+        if self.saved is not None:
+            Node.cmd, Channel.split = self.saved
+            self.saved = None
+
+    def record(self, node, cmd, start, output, end=None):
+        end = time() if end is None else end
+        self.events.append((node.name, cmd, start, end - start, len(output or '')))
+
+    def histograms(self):
+        """Latency of the commands of each kind (see commandKind())
+           returns: {kind: {'count', 'seconds', 'max', 'buckets'}}, where
+                    buckets counts the commands that took up to each bound
+                    of BUCKETS, and longer"""
+        kinds = {}
+        for node, cmd, start, seconds, size in self.events:
+            kind = kinds.setdefault(commandKind(cmd), OrderedDict([
+                ('count', 0), ('seconds', 0.0), ('max', 0.0),
+                ('buckets', [0] * (len(BUCKETS) + 1))]))
+            kind['count'] += 1
+            kind['seconds'] += seconds
+            kind['max'] = max(kind['max'], seconds)
+            ms = seconds * 1000
+            kind['buckets'][next((i for i, bound in enumerate(BUCKETS) if ms <= bound),
+                                 len(BUCKETS))] += 1
+        return OrderedDict(sorted(kinds.items(), key=lambda kind: -kind[1]['seconds']))
+
+    def show(self):
+        info('*** Node commands (kind, count, total s, mean ms, max ms):\n')
+        for kind, h in self.histograms().items():
+            info('   %-20s %6d %9.3f %9.2f %9.2f\n' % (
+                kind, h['count'], h['seconds'], 1000 * h['seconds'] / h['count'],
+                1000 * h['max']))
+
+    def export(self, filename):
+        """Write the trace in the Trace Event Format of chrome://tracing and
+           Perfetto: one row per node, one slice per command"""
+        t0 = min([event[2] for event in self.events] or [0])
+        tids = OrderedDict()
+        events = []
+        for node, cmd, start, seconds, size in self.events:
+            tid = tids.setdefault(node, len(tids) + 1)
+            events.append(OrderedDict([
+                ('name', commandKind(cmd)), ('cat', 'cmd'), ('ph', 'X'),
+                ('ts', (start - t0) * 1e6), ('dur', seconds * 1e6),
+                ('pid', 1), ('tid', tid),
+                ('args', OrderedDict([('cmd', cmd), ('output', size)]))]))
+        for node, tid in tids.items():
+            events.append(OrderedDict([('name', 'thread_name'), ('ph', 'M'), ('pid', 1),
+                                       ('tid', tid), ('args', {'name': node})]))
+        with open(filename, 'w') as f:
+            json.dump(OrderedDict([('traceEvents', events), ('displayTimeUnit', 'ms'),
+                                   ('otherData', {'histograms': self.histograms()})]),
+                      f, separators=(',', ':'))
@@ -1,6 +1,325 @@
 from mininet.util import ipParse, ipStr
+from tempfile import NamedTemporaryFile
+import os
 from mininet.log import info
-from collections import OrderedDict
+from bisect import bisect_left, insort
+from array import array
+from collections import namedtuple, OrderedDict
+
+# Result of Network.locate(): the deepest subnet that contains an address,
+# the router that owns that subnet and the host/interface with the address
+Location = namedtuple('Location', ['subnet', 'router', 'host', 'intf'])
+
+def toAdr(ip):
+    # Unsigned int of an address given as int, 'a.b.c.d' or 'a.b.c.d/x'
+    if isinstance(ip, int):
+        return ip
+    return ipParse(ip.split('/')[0])
+
+def aggregate(routes):
+    """CIDR aggregation: merge the routes to adjacent prefixes that share a
+       next hop, giving the smallest set of prefixes that covers exactly the
+       same addresses.
+       routes: iterable of (base, prefixLen, nexthop); nexthop None: no route
+       returns: list of (base, prefixLen, nexthop) sorted by address"""
+    byHop = OrderedDict()
+    for base, prefixLen, hop in routes:
+        if hop is not None:
+            byHop.setdefault(hop, []).append((base, prefixLen))
+    merged = []
+    for hop, prefixes in byHop.items():
+        stack = []
+        for base, prefixLen in sorted(prefixes):
+            if stack and (base ^ stack[-1][0]) >> (32 - stack[-1][1]) == 0:
+                continue # Already covered by the previous prefix
+            stack.append((base, prefixLen))
+            # Merge the two last prefixes while they are sibling halves
+            while len(stack) > 1:
+                (b1, p1), (b2, p2) = stack[-2:]
+                if p1 != p2 or p1 == 0 or b1 % 2**(33 - p1) or b2 - b1 != 2**(32 - p1):
+                    break
+                stack[-2:] = [(b1, p1 - 1)]
+        merged.extend((b, p, hop) for b, p in stack)
+    merged.sort(key=lambda r: r[:2])
+    return merged
+
+def batchFile(lines):
+    # Write lines to a temporary file and return its name (delete it once used)
+    with NamedTemporaryFile('w', prefix='mn-', suffix='.batch', delete=False) as f:
+        f.write('\n'.join(lines) + '\n')
+    return f.name
+
+def runBatch(node, cmd, lines):
+    """Write lines to a temporary file and run 'cmd file' on node, so that
+       a whole batch (e.g. 'iptables-restore --noflush', 'ip -batch') costs
+       a single command. Returns the output of the command."""
+    name = batchFile(lines)
+    try:
+        return node.cmd(cmd, name)
+    finally:
+        os.remove(name)
+
+class AddressPool(object):
+    """Integer-backed pool of host addresses.
+       Fresh addresses are handed out in increasing order from a bump
+       pointer and released ones are kept in a free-list that is reused
+       first, so both take() and release() are O(1)."""
+    def __init__(self, first, count):
+        """first: first usable address (unsigned int)
+           count: number of usable addresses"""
+        self.first = first
+        self.end = first + count
+        self.nextAdr = first
+        self.free = []
+
+    def available(self):
+        return self.end - self.nextAdr + len(self.free)
+
+    def take(self):
+        # Return a free address (unsigned int), or None if the pool is empty
+        if self.free:
+            return self.free.pop()
+        if self.nextAdr < self.end:
+            self.nextAdr += 1
+            return self.nextAdr - 1
+        return None
+
+    def release(self, adr):
+        # Give back an address previously returned by take()
+        if not self.first <= adr < self.nextAdr:
+            raise ValueError("Address %s does not belong to the pool" % ipStr(adr))
+        self.free.append(adr)
+
+    def exhaust(self):
+        # Drop every remaining address, nothing else will be handed out
+        self.nextAdr = self.end
+        self.free = []
+
+class HostRegistry(object):
+    """Compact name <-> address registry of the hosts of a Network.
+       Hosts live in slots: a list of names and an array of addresses.
+       Names are indexed by a dict and addresses by an array of slot
+       numbers indexed by their offset from the first address, so both
+       lookups are O(1) and an address costs 8 bytes of arrays.
+       It behaves as an ordered mapping of name -> address."""
+    __slots__ = ('first', 'names', 'addrs', 'intfs', 'slots', 'byName', 'freeSlots')
+
+    def __init__(self, first):
+        """first: lowest address that can be registered (unsigned int)"""
+        self.first = first
+        self.clear()
+
+    def clear(self):
+        self.names = []         # slot -> name (None if the slot is free)
+        self.addrs = array('I') # slot -> address
+        self.intfs = []         # slot -> interface name (or None)
+        self.slots = array('I') # address - first -> slot + 1 (0 if unused)
+        self.byName = {}        # name -> slot
+        self.freeSlots = []
+
+    def add(self, name, adr, intf=None):
+        if name in self.byName:
+            raise ValueError("Host %s is already registered" % name)
+        off = adr - self.first
+        if off < 0:
+            raise ValueError("Address %s is out of range" % ipStr(adr))
+        if off >= len(self.slots):
+            self.slots.extend([0] * (off + 1 - len(self.slots)))
+        elif self.slots[off]:
+            raise ValueError("Address %s is already registered" % ipStr(adr))
+        if self.freeSlots:
+            slot = self.freeSlots.pop()
+            self.names[slot] = name
+            self.addrs[slot] = adr
+            self.intfs[slot] = intf
+        else:
+            slot = len(self.names)
+            self.names.append(name)
+            self.addrs.append(adr)
+            self.intfs.append(intf)
+        self.byName[name] = slot
+        self.slots[off] = slot + 1
+
+    def pop(self, name, default=None):
+        # Remove a host and return its address
+        slot = self.byName.pop(name, None)
+        if slot is None:
+            return default
+        adr = self.addrs[slot]
+        self.names[slot] = None
+        self.intfs[slot] = None
+        self.slots[adr - self.first] = 0
+        self.freeSlots.append(slot)
+        return adr
+
+    def name(self, adr):
+        # Name of the host with address adr (unsigned int), or None
+        off = adr - self.first
+        if 0 <= off < len(self.slots) and self.slots[off]:
+            return self.names[self.slots[off] - 1]
+        return None
+
+    def intf(self, name):
+        # Interface that holds the address of host 'name', if it was given
+        return self.intfs[self.byName[name]]
+
+    def __getitem__(self, name):
+        return self.addrs[self.byName[name]]
+
+    def __contains__(self, name):
+        return name in self.byName
+
+    def __len__(self):
+        return len(self.byName)
+
+    def __iter__(self):
+        return (name for name in self.names if name is not None)
+
+    def items(self):
+        return ((name, self.addrs[slot]) for slot, name in enumerate(self.names)
+                if name is not None)
+
+class PrefixTrie(object):
+    """Binary trie of IPv4 prefixes for longest prefix matching.
+       Every node is a list [child0, child1, value]; inserting, removing
+       and matching walk one node per bit of the prefix."""
+    def __init__(self):
+        self.root = [None, None, None]
+        self.size = 0
+
+    def insert(self, base, prefixLen, value):
+        node = self.root
+        for i in range(prefixLen):
+            bit = (base >> (31 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            self.size += 1
+        node[2] = value
+
+    def remove(self, base, prefixLen):
+        # Remove a prefix and prune the nodes that are left empty
+        path = [self.root]
+        for i in range(prefixLen):
+            node = path[-1][(base >> (31 - i)) & 1]
+            if node is None:
+                return None
+            path.append(node)
+        value = path[-1][2]
+        if value is None:
+            return None
+        path[-1][2] = None
+        self.size -= 1
+        for i in range(prefixLen, 0, -1):
+            node = path[i]
+            if node[0] is not None or node[1] is not None or node[2] is not None:
+                break
+            path[i-1][(base >> (32 - i)) & 1] = None
+        return value
+
+    def lookup(self, adr):
+        # Value of the longest prefix that contains adr, or None
+        node = self.root
+        match = node[2]
+        for i in range(32):
+            node = node[(adr >> (31 - i)) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                match = node[2]
+        return match
+
+    def overlaps(self, base, prefixLen):
+        # Values of every prefix that contains or is contained in base/prefixLen
+        found = []
+        node = self.root
+        for i in range(prefixLen):
+            if node[2] is not None:
+                found.append(node[2])
+            node = node[(base >> (31 - i)) & 1]
+            if node is None:
+                return found
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node[2] is not None:
+                found.append(node[2])
+            stack.extend(child for child in node[:2] if child is not None)
+        return found
+
+    def __len__(self):
+        return self.size
+
+class SubnetAllocator(object):
+    """Buddy allocator of the aligned subnets of a network.
+       Free blocks are kept per prefix length; a request is served from the
+       smallest free block that fits (lowest address first), which is split
+       in halves until it has the requested size. Released blocks are merged
+       back with their buddy whenever it is free too."""
+    def __init__(self, base, prefixLen, start=None):
+        """base, prefixLen: network address (unsigned int) and mask length
+           start: first address that can be allocated (default: base)"""
+        self.base = base
+        self.prefixLen = prefixLen
+        self.end = base + 2**(32 - prefixLen)
+        self.free = dict((p, []) for p in range(prefixLen, 33))
+        self.used = {} # base -> prefix length of allocated blocks
+        # Split [start, end) in the largest aligned blocks possible
+        adr = base if start is None else start
+        while adr < self.end:
+            p = prefixLen
+            while adr % 2**(32 - p) or adr + 2**(32 - p) > self.end:
+                p += 1
+            self.free[p].append(adr)
+            adr += 2**(32 - p)
+
+    def alloc(self, prefixLen):
+        # Allocate an aligned block of mask prefixLen. Returns its base or None
+        if prefixLen < self.prefixLen:
+            return None
+        p = prefixLen
+        while p >= self.prefixLen and not self.free[p]:
+            p -= 1
+        if p < self.prefixLen:
+            return None
+        adr = self.free[p].pop(0)
+        while p < prefixLen:
+            p += 1
+            insort(self.free[p], adr + 2**(32 - p))
+        self.used[adr] = prefixLen
+        return adr
+
+    def release(self, adr):
+        # Give back the block starting at adr, merging it with its free buddies
+        p = self.used.pop(adr)
+        while p > self.prefixLen:
+            buddy = adr ^ 2**(32 - p)
+            blocks = self.free[p]
+            i = bisect_left(blocks, buddy)
+            if i == len(blocks) or blocks[i] != buddy:
+                break
+            del blocks[i]
+            adr = min(adr, buddy)
+            p -= 1
+        insort(self.free[p], adr)
+
+    def stats(self):
+        # Fragmentation statistics of the address space (sizes in addresses)
+        freeAdrs = 0
+        largest = 0
+        nblocks = 0
+        for p, blocks in self.free.items():
+            if blocks:
+                freeAdrs += len(blocks) * 2**(32 - p)
+                largest = max(largest, 2**(32 - p))
+                nblocks += len(blocks)
+        return {'size': self.end - self.base,
+                'used': sum(2**(32 - p) for p in self.used.values()),
+                'free': freeAdrs,
+                'freeBlocks': nblocks,
+                'largestFree': largest,
+                'fragmentation': 1 - float(largest) / freeAdrs if freeAdrs else 0.0}
 
 class Network(object):
     def __init__(self, ip='10.0.0.0/8', nextSubnet=None):
@@ -8,68 +327,166 @@ class Network(object):
            nextSubnet: a.b.c.d next subnet IP address"""
         self.ip = ip
         self.baseAdr, self.mask = ip.split('/')
-        self.nextAdr = ipStr(ipParse(self.baseAdr) + 1)
-        self.maxHosts = 2**(32 - int(self.mask)) - 2
-        self.hosts = OrderedDict()
-        self.nHosts = 0
+        self.base = ipParse(self.baseAdr)
+        self.prefixLen = int(self.mask)
+        self.size = 2**(32 - self.prefixLen)
+        self.maxHosts = self.size - 2
+        self.pool = AddressPool(self.base + 1, self.maxHosts)
+        self.hosts = HostRegistry(self.base + 1)
         self.subnets = []
-        if nextSubnet is None:
-            self.nextSubnet = self.baseAdr
-        else:
-            self.nextSubnet = nextSubnet
+        self.nextSubnet = self.baseAdr if nextSubnet is None else nextSubnet
+        self.allocator = None # Created when the Network is first divided
+        self.trie = PrefixTrie() # Index of the subnets
+        self.router = None # Name of the router that owns the Network
+
+    @property
+    def nHosts(self):
+        return len(self.hosts)
 
     def hostIP(self, name):
         # Get IP (a.b.c.d/x) address of a host by its name
-        return self.hosts[name] + '/' + self.mask
+        return ipStr(self.hosts[name]) + '/' + self.mask
 
-    def giveIP(self, name):
-        # Give ip (a.b.c.d) to a host of name 'name' and add it to the Network
-        if self.nextAdr is None:
-            if self.subnets is not None:
+    def giveIP(self, name, intf=None):
+        """Give ip (a.b.c.d) to a host of name 'name' and add it to the Network
+           intf: name of the interface of the host that will have the address"""
+        if name in self.hosts:
+            info("Host", name, "already belongs to", self.ip, "\n")
+            return self.hostIP(name)
+        adr = self.pool.take()
+        if adr is None:
+            if self.subnets:
                 info("Adding host", name, "to subnet", self.subnets[-1].ip,"\n")
-                return self.subnets[-1].giveIP(name)
+                return self.subnets[-1].giveIP(name, intf)
             else:
                 info("There aren't addresses available. Host",
                        name, "has not been added to", self.ip,"\n")
         else:
-            self.hosts[name] = self.nextAdr
-            self.nHosts += 1
-            if self.nHosts == self.maxHosts:
-                self.nextAdr = None
-            else:
-                self.nextAdr = ipStr(ipParse(self.nextAdr) + 1)
+            self.hosts.add(name, adr, intf)
             return self.hostIP(name) # Return IP (a.b.c.d/x) of the newly added host
 
-    def addSubnet(self, minHosts):
+    def releaseIP(self, name):
+        # Remove host 'name' from the Network and make its address available again
+        adr = self.hosts.pop(name, None)
+        if adr is None:
+            info("Host", name, "does not belong to", self.ip, "\n")
+            return False
+        self.pool.release(adr)
+        return True
+
+    def contains(self, ip):
+        adr = toAdr(ip)
+        return self.base <= adr < self.base + self.size
+
+    def locate(self, ip):
+        # Longest prefix match of ip over the Network and its subnets (a Location)
+        adr = toAdr(ip)
+        if not self.contains(adr):
+            return None
+        net = self
+        while net.trie:
+            subnet = net.trie.lookup(adr)
+            if subnet is None:
+                break
+            net = subnet
+        host = net.hosts.name(adr)
+        return Location(net, net.router, host,
+                        None if host is None else net.hosts.intf(host))
+
+    def hostName(self, ip):
+        # Name of the host (of the Network or its subnets) that has address ip
+        location = self.locate(ip)
+        return None if location is None else location.host
+
+    def overlaps(self, ip):
+        # Subnets that overlap with network ip (a.b.c.d/x)
+        adr, mask = ip.split('/')
+        return self.trie.overlaps(ipParse(adr), int(mask))
+
+    def addSubnet(self, minHosts, router=None):
+        """minHosts: minimum number of hosts of the subnet
+           router: name of the router that owns the subnet"""
         # A network that has been divided into subnets cannot be used anymore
         if self.hosts:
             info("Deleting previous hosts of the Network...\n")
             self.hosts.clear()
-        self.nextAdr = None
+        self.pool.exhaust()
+
+        if self.allocator is None:
+            self.allocator = SubnetAllocator(self.base, self.prefixLen,
+                                             ipParse(self.nextSubnet))
 
         # Compute Subnet IP Address
         hostbits = (minHosts+1).bit_length() # Equivalent to ceil(log2(minHosts+2))
         subnetMask = 32 - hostbits
-        if self.subnets and (subnetMask < int(self.subnets[-1].mask)):
-            subnetAdr = ipStr(self.subnets[-1].maxHosts + 2 +
-                              ipParse(self.subnets[-1].baseAdr))
-        else:
-            subnetAdr = self.nextSubnet
+        subnetAdr = self.allocator.alloc(subnetMask)
+        if subnetAdr is None:
+            info("There isn't space for a subnet of", minHosts, "hosts in",
+                 self.ip, "\n")
+            return None
 
         # Create Subnet and return
-        subnet = Network(subnetAdr + '/' + str(subnetMask))
+        subnet = Network(ipStr(subnetAdr) + '/' + str(subnetMask))
+        subnet.router = router
         self.subnets.append(subnet)
-        self.nextSubnet = ipStr(2**hostbits + ipParse(subnetAdr))
+        self.trie.insert(subnetAdr, subnetMask, subnet)
         return subnet
 
+    def addSubnets(self, hostCounts, routers=None):
+        """Variable length subnetting: add one subnet for each entry of
+           hostCounts (minimum number of hosts of each subnet).
+           Subnets are allocated largest first, which packs them without
+           holes, but they are returned (and kept in self.subnets) in the
+           same order as hostCounts. Returns None if they don't fit.
+           routers: name of the router that owns each subnet"""
+        order = sorted(range(len(hostCounts)), key=lambda i: -hostCounts[i])
+        subnets = [None] * len(hostCounts)
+        for i in order:
+            subnets[i] = self.addSubnet(hostCounts[i],
+                                        None if routers is None else routers[i])
+            if subnets[i] is None:
+                for s in subnets:
+                    if s is not None:
+                        self.releaseSubnet(s)
+                return None
+        # Keep the subnets listed in the order they were requested
+        self.subnets[len(self.subnets) - len(subnets):] = subnets
+        return subnets
+
+    def releaseSubnet(self, subnet):
+        # Remove a subnet (Network or a.b.c.d/x) and make its addresses available again
+        ip = subnet if isinstance(subnet, str) else subnet.ip
+        for i, s in enumerate(self.subnets):
+            if s.ip == ip:
+                del self.subnets[i]
+                self.trie.remove(s.base, s.prefixLen)
+                self.allocator.release(s.base)
+                return True
+        info("Subnet", ip, "does not belong to", self.ip, "\n")
+        return False
+
+    def aggregateRoutes(self, nexthop):
+        """Routes to the subnets, aggregated (see aggregate())
+           nexthop: function that gives the next hop of a subnet (None: no route)
+           returns: list of (a.b.c.d/x, nexthop)"""
+        routes = aggregate((s.base, s.prefixLen, nexthop(s)) for s in self.subnets)
+        return [(ipStr(base) + '/' + str(prefixLen), hop)
+                for base, prefixLen, hop in routes]
+
+    def subnetStats(self):
+        # Fragmentation statistics of the space reserved for subnets
+        if self.allocator is None:
+            return None
+        return self.allocator.stats()
+
     def show(self):
         info("Network IP Address:", self.ip,"\n")
-        for name, ip in self.hosts.items():
-            info("  ", name + ":", ip,"\n")
+        for name, adr in self.hosts.items():
+            info("  ", name + ":", ipStr(adr),"\n")
 
         for s in self.subnets:
             info("  Subnet:", s.ip, "\n")
-            for name, ip in s.hosts.items():
-                info("    ", name + ":", ip,"\n")
+            for name, adr in s.hosts.items():
+                info("    ", name + ":", ipStr(adr),"\n")
 
         info("\n")
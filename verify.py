@@ -0,0 +1,111 @@
+from mininet.log import info, error
+from parallel import fanOut
+from plan import address
+from firewall import FIREWALLS
+from collections import OrderedDict
+import random
+
+def lanHosts(plan):
+    """Hosts of each local subnet of plan
+       returns: [(router, [host])] for the subnets that have hosts"""
+    lans, hosts = [], iter(plan.hosts)
+    for router, nhosts in zip(plan.routers, plan.params['nhosts']):
+        names = [next(hosts)[0] for i in range(nhosts)]
+        if names:
+            lans.append((router, names))
+    return lans
+
+def pingCommand(ip, timeout=1):
+    return 'ping -c1 -W%d %s' % (timeout, ip)
+
+def connectCommand(ip, port, wait=10):
+    # TCP connection to ip:port, retried for up to wait seconds until something listens
+    return ("(end=$((SECONDS+%d)); until timeout 1 bash -c '</dev/tcp/%s/%s' 2>/dev/null; "
+            "do [ $SECONDS -gt $end ] && exit 1; sleep 0.2; done)" % (wait, ip, port))
+
+def probes(plan, maxPairs=None, outside='8.8.8.8', seed=None, timeout=1, wait=10):
+    """Stratified sample of the connectivity of plan: one probe per pair of
+       local subnets, between random hosts of each, one probe from every
+       subnet to an outside address through the NAT (egress), a check that
+       the NAT has the DNAT rule of each forwarded port (dnat) and a TCP
+       connection from the NAT to each host with forwarded TCP ports
+       (server). Packets sent from the NAT don't go through its PREROUTING
+       hook, so the DNAT rules are checked in the firewall and the server
+       probe connects to the address of the host.
+       maxPairs: probe at most this many random pairs of subnets
+       wait: seconds the servers have to start listening
+       returns: {stratum: [(source, (row, column), destination name, cmd)]}
+                where (row, column) is the cell of the reachability matrix"""
+    rand = random.Random(seed)
+    ips = dict(plan.hosts)
+    lans = lanHosts(plan)
+    pairs = [(a, b) for a in lans for b in lans if a is not b]
+    if maxPairs is not None and len(pairs) > maxPairs:
+        pairs = [pairs[i] for i in sorted(rand.sample(range(len(pairs)), maxPairs))]
+    strata = OrderedDict()
+    strata['lan'] = []
+    for (router1, hosts1), (router2, hosts2) in pairs:
+        src, dst = rand.choice(hosts1), rand.choice(hosts2)
+        strata['lan'].append((src, (router1, router2), dst,
+                              pingCommand(address(ips[dst]), timeout)))
+    strata['egress'] = [(rand.choice(hosts), (router, 'out'), outside,
+                         pingCommand(outside, timeout)) for router, hosts in lans]
+    nat = plan.nats[0][0]
+    names = dict((address(ip), name) for name, ip in plan.hosts)
+    firewall = FIREWALLS[plan.firewall]
+    strata['dnat'] = [(nat, (inIntf, names[dest.split(':')[0]]), dest,
+                       firewall.checkDNATCommand(inIntf, proto, port, dest))
+                      for inIntf, proto, port, dest in plan.forwards]
+    strata['server'] = []
+    for inIntf, proto, port, dest in plan.forwards:
+        if proto != 'tcp':
+            continue
+        ip, port = dest.split(':')
+        strata['server'].append((nat, (nat, names[ip]), dest, connectCommand(ip, port, wait)))
+    return strata
+
+def verifyNetwork(net, plan, maxPairs=None, outside='8.8.8.8', seed=None, timeout=1,
+                  wait=10):
+    """Check the connectivity of the network of plan with the probes of
+       probes(), running every probe of a stratum at the same time. Strata
+       are checked in order and the check stops at the first stratum with
+       a failed probe.
+       returns: True if every probe succeeded, and the reachability matrix
+                {(row, column): True/False}"""
+    matrix = OrderedDict()
+    for stratum, checks in probes(plan, maxPairs, outside, seed, timeout, wait).items():
+        if not checks:
+            continue
+        info('*** Checking %s connectivity (%d probes)\n' % (stratum, len(checks)))
+        results = fanOut([(net.get(src), cmd) for src, cell, dst, cmd in checks])
+        failed = []
+        for (src, cell, dst, cmd), (node, output, status) in zip(checks, results):
+            matrix[cell] = status == 0
+            if status != 0:
+                failed.append('%s -> %s' % (src, dst))
+        if failed:
+            error('*** %s connectivity failed: %s\n' % (stratum, ', '.join(failed)))
+            return False, matrix
+    return True, matrix
+
+def showMatrix(matrix, plan):
+    """Print the reachability matrix of verifyNetwork(): a row per source
+       subnet (the NAT for the servers, the outside interface for the DNAT
+       rules), a column per destination ('out': egress). '+': reachable,
+       'X': unreachable, '.': not probed"""
+    if not matrix:
+        return
+    names = (plan.routers + [plan.nats[0][0]] +
+             [inIntf for inIntf, proto, port, dest in plan.forwards] +
+             ['out'] + [name for name, ip in plan.hosts])
+    rows = set(row for row, column in matrix)
+    columns = set(column for row, column in matrix)
+    rows = [name for name in names if name in rows]
+    columns = [name for name in names if name in columns]
+    width = max(len(str(name)) for name in rows + columns)
+    info(' ' * (width + 1) + ' '.join(str(c).rjust(width) for c in columns) + '\n')
+    for row in rows:
+        cells = [matrix.get((row, column)) for column in columns]
+        info(str(row).rjust(width) + ' ' + ' '.join(
+            ('.' if cell is None else '+' if cell else 'X').rjust(width)
+            for cell in cells) + '\n')